@@ -19,129 +19,509 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import argparse
 import asyncio
+import hashlib
 import json
 import logging
 import os
-import tempfile
+import pickle
+import stat
 import sys
-from datetime import datetime, timedelta, timezone
-from typing import List, Optional
+from concurrent.futures import Executor
+from contextlib import AsyncExitStack, nullcontext
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import (
+    TYPE_CHECKING,
+    BinaryIO,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from icalendar import Calendar  # type: ignore
+from icalendar import Calendar, Event  # type: ignore
 
-from .config import CalendarSource, Config, load_config
-from .download import add_exec_bit, download_ics
-from .ics import PRODID, as_str, list_of_dict_events, merge
+from .config import CalendarSource, Config, HttpConfig, load_config
+from .ics import (
+    DEFAULT_DICT_EVENT_FIELDS,
+    PRODID,
+    EventRecord,
+    IncrementalMerge,
+    OccurrenceIndex,
+    TimezoneRegistry,
+    iter_ical,
+    list_of_dict_events,
+    occurs_between,
+    prune_and_sort_records,
+)
+from .processors import run_processors
+from .util import replace_file
+
+# aiohttp takes long to import and is not needed by worker processes
+if TYPE_CHECKING:
+    import aiohttp
 
 logger = logging.getLogger(__name__)
 
 
+def parse_calendar(fp: BinaryIO) -> Calendar:
+    try:
+        return Calendar.from_ical(fp.read())
+    except ValueError:
+        raise ValueError("cannot parse %r" % fp.name)
+
+
+def load_processed(
+    name: str,
+    digest: str,
+    fingerprint: str,
+    *,
+    now: Optional[datetime] = None,
+) -> Optional[Calendar]:
+    try:
+        with open(name, "rb") as fp:
+            # the key is pickled separately, so a stale calendar is never loaded
+            if pickle.load(fp) != (digest, fingerprint):
+                return None
+            pruned_before, cal = pickle.load(fp)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("ignoring broken cache %r", name, exc_info=True)
+        return None
+    if not isinstance(cal, Calendar):
+        return None
+    # a calendar pruned later than now misses events, e.g. if an output window
+    # was extended into the past
+    if pruned_before is not None and (now is None or pruned_before > now):
+        return None
+    return cal
+
+
+def save_processed(
+    name: str,
+    digest: str,
+    fingerprint: str,
+    cal: Calendar,
+    mode: int = stat.S_IRUSR | stat.S_IWUSR,
+    *,
+    now: Optional[datetime] = None,
+) -> None:
+    # now is when cal was pruned, None if it was not
+    def write(fp: BinaryIO) -> None:
+        pickle.dump((digest, fingerprint), fp, pickle.HIGHEST_PROTOCOL)
+        pickle.dump((now, cal), fp, pickle.HIGHEST_PROTOCOL)
+
+    replace_file(name, mode, write)
+
+
+async def process_calendar(calsrc: CalendarSource, cal: Calendar) -> Calendar:
+    await run_processors(calsrc.processors, cal)
+    return cal
+
+
+def prepare_calendar(
+    calsrc: CalendarSource,
+    name: str,
+    now: Optional[datetime] = None,
+) -> Tuple[Calendar, Optional[List[EventRecord]]]:
+    # May run in a worker process, so all arguments and the result are pickled.
+    # Dropping passed events early keeps the result small. The records are
+    # returned as well, so the event loop does not decode and sort the events
+    # again, being pickled together they still refer to the calendar's events.
+    with open(name, "rb") as fp:
+        cal = parse_calendar(fp)
+    cal = asyncio.run(process_calendar(calsrc, cal))
+    return (cal, None if now is None else prune_and_sort_records(cal, now))
+
+
+@dataclass
+class LoadedCalendar:
+    # digest of the downloaded calendar, None if there is no local copy
+    digest: Optional[str]
+    calendar: Calendar
+    # the pruned and sorted events of calendar, if it was pruned
+    records: Optional[List[EventRecord]] = None
+
+
 async def load_calendar(
     calsrc: CalendarSource,
     directory: str,
     maxsize: int,
-) -> Calendar:
+    client: Optional["aiohttp.ClientSession"] = None,
+    previous: Optional[LoadedCalendar] = None,
+    *,
+    now: Optional[datetime] = None,
+    executor: Optional[Executor] = None,
+) -> LoadedCalendar:
+    cache = os.path.join(directory, "processed.pickle")
+
+    async def parse(fp: BinaryIO, digest: str) -> LoadedCalendar:
+        if previous is not None and previous.digest == digest:
+            return previous
+        # skip parsing and processing if neither the calendar nor the
+        # processors changed since the last run
+        records = None  # type: Optional[List[EventRecord]]
+        cached = load_processed(cache, digest, calsrc.fingerprint, now=now)
+        if cached is not None:
+            logger.debug("%s is unchanged, using cache %r", calsrc.url, cache)
+            if now is not None:
+                records = prune_and_sort_records(cached, now)
+            return LoadedCalendar(digest, cached, records)
+
+        if executor is None:
+            cal = await process_calendar(calsrc, parse_calendar(fp))
+            if now is not None:
+                records = prune_and_sort_records(cal, now)
+        else:
+            cal, records = await asyncio.get_running_loop().run_in_executor(
+                executor,
+                prepare_calendar,
+                calsrc,
+                fp.name,
+                now,
+            )
+        try:
+            save_processed(cache, digest, calsrc.fingerprint, cal, now=now)
+        except Exception:
+            logger.exception("failed to cache %r", cache)
+        return LoadedCalendar(digest, cal, records)
+
     try:
-        with await download_ics(calsrc.url, directory, maxsize=maxsize) as fp:
-            ics = fp.read()
-    except FileNotFoundError:
-        ics = b"\r\n".join(
-            [
-                b"BEGIN:VCALENDAR",
-                b"PRODID:" + as_str(PRODID).encode("utf-8", "surrogateescape"),
-                b"VERSION:2.0",
-                b"END:VCALENDAR",
-            ]
+        from .download import download_calendar
+
+        # the download is validated by parsing it, so reuse that result
+        return await download_calendar(
+            calsrc.url,
+            directory,
+            parse,
+            maxsize=maxsize,
+            client=client,
         )
+    except FileNotFoundError:
+        if previous is not None and previous.digest is None:
+            return previous
+        cal = Calendar()
+        cal.add("prodid", PRODID)
+        cal.add("version", "2.0")
+        return LoadedCalendar(None, await process_calendar(calsrc, cal))
+
+
+def _file_digest(name: str) -> Optional[str]:
     try:
-        cal = Calendar.from_ical(ics)
-    except ValueError:
-        raise ValueError("cannot parse %s" % directory)
-    for processor in calsrc.processors:
-        await processor.run(cal)
-    return cal
+        with open(name, "rb") as fp:
+            return hashlib.file_digest(fp, "sha256").hexdigest()
+    except FileNotFoundError:
+        return None
+
 
+def write_output(
+    destdir: str,
+    filename: str,
+    destmode: int,
+    data: Union[bytes, Iterable[bytes]],
+) -> bool:
+    from .download import add_exec_bit
 
-def write_ics(destdir: str, destmode: int, cal: Calendar) -> None:
     os.makedirs(destdir, mode=add_exec_bit(destmode), exist_ok=True)
-    tmp = tempfile.NamedTemporaryFile(dir=destdir, prefix=".tmp.", suffix=".ics")
+    dest = os.path.join(destdir, filename)
+    h = hashlib.sha256()
+
+    def write(fp: BinaryIO) -> bool:
+        # the output is streamed to disk, it is never held in memory as a whole
+        for chunk in [data] if isinstance(data, bytes) else data:
+            h.update(chunk)
+            fp.write(chunk)
+        # leave unchanged files alone, so caches and sync clients are not
+        # invalidated by a new mtime
+        return _file_digest(dest) != h.hexdigest()
+
+    changed = replace_file(dest, destmode, write)
+    if not changed:
+        logger.debug("%r is unchanged", dest)
+
+    etag = ('"%s"' % h.hexdigest()).encode("ascii")
+
     try:
-        tmp.write(cal.to_ical())
-        tmp.flush()
-        os.chmod(tmp.fileno(), destmode)
-        os.replace(tmp.name, os.path.join(destdir, "calendar.ics"))
-    finally:
-        # if everything is successful it will have been moved
-        try:
-            tmp.close()
-        except FileNotFoundError:
-            pass
+        with open(dest + ".etag", "rb") as fp:
+            old_etag = fp.read()  # type: Optional[bytes]
+    except FileNotFoundError:
+        old_etag = None
+    if old_etag != etag:
+        replace_file(dest + ".etag", destmode, lambda fp: fp.write(etag))
+
+    return changed
+
+
+def write_ics(
+    destdir: str,
+    destmode: int,
+    cal: Union[Calendar, Iterable[bytes]],
+    *,
+    filename: str = "calendar.ics",
+) -> bool:
+    return write_output(
+        destdir,
+        filename,
+        destmode,
+        iter_ical(cal) if isinstance(cal, Calendar) else cal,
+    )
 
 
 def write_json(
     destdir: str,
     destmode: int,
-    cal: Calendar,
+    cal: Union[Calendar, OccurrenceIndex],
     after: datetime,
     before: datetime,
+    *,
+    filename: str = "calendar.json",
+    fields: Iterable[str] = DEFAULT_DICT_EVENT_FIELDS,
+    include: Optional[Callable[[Event], bool]] = None,
+) -> bool:
+    events = list_of_dict_events(
+        cal,
+        after=after,
+        before=before,
+        fields=fields,
+        include=include,
+    )
+    data = json.dumps(events, ensure_ascii=False, indent=2, separators=(",", ": "))
+    return write_output(
+        destdir,
+        filename,
+        destmode,
+        (data + "\n").encode("utf-8"),
+    )
+
+
+def create_client(http: HttpConfig) -> "aiohttp.ClientSession":
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(
+        limit=http.limit,
+        limit_per_host=http.limit_per_host,
+        keepalive_timeout=http.keepalive_timeout,
+        ttl_dns_cache=http.dns_cache_ttl,
+        use_dns_cache=http.dns_cache_ttl > 0,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=http.timeout or None),
+    )
+
+
+def _prune_before(config: Config) -> datetime:
+    return datetime.now(timezone.utc) + config.prune_before
+
+
+def _from_sources(
+    merger: IncrementalMerge,
+    names: Iterable[str],
+) -> Callable[[Event], bool]:
+    selected = set(map(id, merger.events(names)))
+    return lambda event: id(event) in selected
+
+
+def write_outputs(
+    config: Config,
+    merger: IncrementalMerge,
+    now: Optional[datetime] = None,
 ) -> None:
-    os.makedirs(destdir, mode=add_exec_bit(destmode), exist_ok=True)
-    tmp = tempfile.NamedTemporaryFile(
-        mode="w",
-        encoding="utf-8",
-        dir=destdir,
-        prefix=".tmp.",
-        suffix=".json",
+    if now is None:
+        now = datetime.now(timezone.utc)
+    # all outputs share one expansion of the occurrences, ICS outputs are
+    # serialized one event at a time
+    index = None  # type: Optional[OccurrenceIndex]
+    for filename, output in config.outputs.items():
+        if output.after is None or output.before is None:
+            write_ics(
+                config.destdir,
+                config.destmode,
+                merger.ical(output.calendars),
+                filename=filename,
+            )
+            continue
+
+        if index is None:
+            index = OccurrenceIndex(merger.records())
+        after = now + output.after
+        before = now + output.before
+        if output.format == "ics":
+            write_ics(
+                config.destdir,
+                config.destmode,
+                merger.ical(
+                    output.calendars,
+                    include=occurs_between(index, after, before),
+                ),
+                filename=filename,
+            )
+        else:
+            write_json(
+                config.destdir,
+                config.destmode,
+                index,
+                after=after,
+                before=before,
+                filename=filename,
+                fields=output.fields,
+                include=(
+                    None
+                    if output.calendars is None
+                    else _from_sources(merger, output.calendars)
+                ),
+            )
+
+
+def create_merger(config: Config) -> IncrementalMerge:
+    # VTIMEZONEs already compared with the system's zoneinfo in earlier runs
+    # are not compared again
+    return IncrementalMerge(
+        timezones=TimezoneRegistry(os.path.join(config.workdir, "timezones.json"))
     )
+
+
+def save_timezones(merger: IncrementalMerge) -> None:
     try:
-        events = list_of_dict_events(
-            cal,
-            after=after,
-            before=before,
-        )
-        json.dump(events, tmp, ensure_ascii=False, indent=2, separators=(",", ": "))
-        tmp.write("\n")
-        tmp.flush()
-        os.chmod(tmp.fileno(), destmode)
-        os.replace(tmp.name, os.path.join(destdir, "calendar.json"))
-    finally:
-        # if everything is successful it will have been moved
-        try:
-            tmp.close()
-        except FileNotFoundError:
-            pass
+        merger.timezones.save()
+    except Exception:
+        logger.exception("failed to cache %r", merger.timezones.path)
 
 
-async def run(config: Config) -> None:
-    assert config.calendars, "no calendar sources specified"
-    calsrcs = list(config.calendars.items())
-    logger.debug("downloading %d calendars...", len(calsrcs))
-    cals = await asyncio.gather(
+def create_executor(config: Config) -> ContextManager[Optional[Executor]]:
+    if config.workers > 0:
+        from concurrent.futures import ProcessPoolExecutor
+
+        return ProcessPoolExecutor(config.workers)
+    else:
+        return nullcontext()
+
+
+async def load_all(
+    config: Config,
+    client: "aiohttp.ClientSession",
+    now: datetime,
+    executor: Optional[Executor] = None,
+) -> Dict[str, LoadedCalendar]:
+    logger.debug("downloading %d calendars...", len(config.calendars))
+    loaded = await asyncio.gather(
         *(
             load_calendar(
                 calsrc,
                 os.path.join(config.workdir, name),
                 maxsize=config.maxsize,
+                client=client,
+                now=now,
+                executor=executor,
             )
-            for name, calsrc in calsrcs
+            for name, calsrc in config.calendars.items()
         )
     )
-    logger.debug("merging %d calendars...", len(calsrcs))
-    now = datetime.now(timezone.utc) - timedelta(hours=12)
-    merged = merge(cals, now=now)
-    write_ics(config.destdir, config.destmode, merged)
-    write_json(
-        config.destdir,
-        config.destmode,
-        merged,
-        after=now,
-        before=now + timedelta(weeks=4, days=1),
-    )
+    return dict(zip(config.calendars, loaded))
+
+
+async def run(config: Config) -> None:
+    assert config.calendars, "no calendar sources specified"
+    now = _prune_before(config)
+    # share one connection pool, so sources on the same host reuse connections
+    async with AsyncExitStack() as stack:
+        executor = stack.enter_context(create_executor(config))
+        client = await stack.enter_async_context(create_client(config.http))
+        loaded = await load_all(config, client, now, executor)
+    logger.debug("merging %d calendars...", len(loaded))
+    merger = create_merger(config)
+    for name, x in loaded.items():
+        merger.update(name, x.calendar, now=now, records=x.records)
+    save_timezones(merger)
+    write_outputs(config, merger)
+
+
+async def daemon(config: Config) -> None:
+    assert config.calendars, "no calendar sources specified"
+    async with AsyncExitStack() as stack:
+        executor = stack.enter_context(create_executor(config))
+        client = await stack.enter_async_context(create_client(config.http))
+        now = _prune_before(config)
+        loaded = await load_all(config, client, now, executor)
+        merger = create_merger(config)
+        for name, x in loaded.items():
+            merger.update(name, x.calendar, now=now, records=x.records)
+        save_timezones(merger)
+        write_outputs(config, merger)
+        changed = asyncio.Event()
+
+        async def refresh(name: str, calsrc: CalendarSource) -> None:
+            interval = calsrc.interval or config.interval
+            while True:
+                await asyncio.sleep(interval.total_seconds())
+                logger.debug("refreshing %r...", name)
+                try:
+                    result = await load_calendar(
+                        calsrc,
+                        os.path.join(config.workdir, name),
+                        maxsize=config.maxsize,
+                        client=client,
+                        previous=loaded[name],
+                        now=_prune_before(config),
+                        executor=executor,
+                    )
+                except Exception:
+                    logger.exception("failed to refresh %r", name)
+                    continue
+                if result is not loaded[name]:
+                    logger.info("%r changed", name)
+                    loaded[name] = result
+                    # only the changed source is sorted again
+                    merger.update(
+                        name,
+                        result.calendar,
+                        now=_prune_before(config),
+                        records=result.records,
+                    )
+                    save_timezones(merger)
+                    changed.set()
+
+        async def remerge() -> None:
+            while True:
+                # passed events and the JSON window depend on the current time,
+                # so merge at least every interval even if nothing changed
+                try:
+                    await asyncio.wait_for(
+                        changed.wait(),
+                        config.interval.total_seconds(),
+                    )
+                    timed_out = False
+                except TimeoutError:
+                    timed_out = True
+                changed.clear()
+                logger.debug("merging %d calendars...", len(loaded))
+                try:
+                    if timed_out:
+                        merger.prune(_prune_before(config))
+                    write_outputs(config, merger)
+                except Exception:
+                    # e.g. a full disk, try again next time
+                    logger.exception("failed to write the merged calendars")
+
+        async with asyncio.TaskGroup() as tg:
+            for name, calsrc in config.calendars.items():
+                tg.create_task(refresh(name, calsrc))
+            tg.create_task(remerge())
 
 
 def main(argv: Optional[List[str]] = None) -> None:
     p = argparse.ArgumentParser(description="TODO")
     p.add_argument("-c", "--config", required=True, help="configuration file")
+    p.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running and refresh every calendar on its own interval",
+    )
     args = p.parse_args(argv)
 
     logging.basicConfig(
@@ -151,4 +531,8 @@ def main(argv: Optional[List[str]] = None) -> None:
     )
 
     config = load_config(args.config)
-    asyncio.run(run(config))
+    try:
+        asyncio.run(daemon(config) if args.daemon else run(config))
+    except KeyboardInterrupt:
+        if not args.daemon:
+            raise
@@ -17,8 +17,13 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import hashlib
+import json
 import os.path
+import sys
 from dataclasses import dataclass, field
+from datetime import timedelta
+from functools import lru_cache
 from typing import Any, Dict, List, Optional, Union
 
 try:
@@ -26,14 +31,66 @@ try:
 except ImportError:
     import tomli as tomllib  # type: ignore
 
+import icalendar  # type: ignore
+
+from ..ics import DEFAULT_DICT_EVENT_FIELDS, DICT_EVENT_FIELDS
 from ..processors import CalendarProcessor, all_processors
-from .util import ConfigPath, parse_size, str_option_path
+from .util import ConfigPath, parse_duration, parse_size, str_option_path
 
 
 @dataclass
 class CalendarSource:
     url: str
     processors: List[CalendarProcessor] = field(default_factory=list)
+    # digest of the processor configuration and code, to detect stale cached
+    # results
+    fingerprint: str = ""
+    # refresh interval in daemon mode, defaults to Config.interval
+    interval: Optional[timedelta] = None
+
+
+@dataclass
+class HttpConfig:
+    # 0 means unlimited
+    limit: int = 100
+    limit_per_host: int = 0
+    keepalive_timeout: float = 15
+    dns_cache_ttl: int = 10
+    timeout: float = 5 * 60
+
+
+@dataclass
+class OutputConfig:
+    # "ics" or "json"
+    format: str
+    # window relative to the time of the run, None means unbounded for ICS
+    after: Optional[timedelta] = None
+    before: Optional[timedelta] = None
+    # JSON only
+    fields: List[str] = field(default_factory=lambda: list(DEFAULT_DICT_EVENT_FIELDS))
+    # names of the merged calendar sources, None means all of them
+    calendars: Optional[List[str]] = None
+
+
+OUTPUT_FORMATS = ("ics", "json")
+
+# events that ended longer ago are dropped, unless an output window needs them
+PRUNE_BEFORE = timedelta(hours=-12)
+
+
+def _json_output() -> OutputConfig:
+    return OutputConfig(
+        format="json",
+        after=timedelta(hours=-12),
+        before=timedelta(weeks=4, hours=12),
+    )
+
+
+def default_outputs() -> Dict[str, OutputConfig]:
+    return {
+        "calendar.ics": OutputConfig(format="ics"),
+        "calendar.json": _json_output(),
+    }
 
 
 @dataclass
@@ -43,12 +100,63 @@ class Config:
     destmode: int
     maxsize: int
     calendars: Dict[str, CalendarSource]
+    http: HttpConfig = field(default_factory=HttpConfig)
+    interval: timedelta = timedelta(minutes=15)
+    # parse and process in this many worker processes, 0 disables them
+    workers: int = 0
+    # keyed by file name in destdir
+    outputs: Dict[str, OutputConfig] = field(default_factory=default_outputs)
+
+    # Events that ended before now + prune_before are dropped when loading, so
+    # it reaches back as far as the earliest output window.
+    @property
+    def prune_before(self) -> timedelta:
+        return min(
+            [PRUNE_BEFORE]
+            + [x.after for x in self.outputs.values() if x.after is not None]
+        )
 
 
 class ConfigError(Exception):
     pass
 
 
+# bump when the processed calendars are cached differently
+PROCESSED_CACHE_VERSION = 2
+
+
+@lru_cache(maxsize=None)
+def _module_digest(name: str) -> str:
+    # changes to the code of a processor change its results
+    h = hashlib.sha256(name.encode("utf-8"))
+    filename = getattr(sys.modules[name], "__file__", None)
+    if filename is not None:
+        try:
+            with open(filename, "rb") as fp:
+                h.update(fp.read())
+        except OSError:
+            pass
+    return h.hexdigest()
+
+
+def _fingerprint(config: Any, processors: List[CalendarProcessor]) -> str:
+    # the shared helpers in ics are used by all processors
+    modules = {"icsmerge.ics", "icsmerge.processors"}
+    modules.update(type(proc).__module__ for proc in processors)
+    return hashlib.sha256(
+        json.dumps(
+            {
+                "version": PROCESSED_CACHE_VERSION,
+                "icalendar": getattr(icalendar, "__version__", None),
+                "code": {name: _module_digest(name) for name in sorted(modules)},
+                "processors": config,
+            },
+            sort_keys=True,
+            default=str,
+        ).encode("utf-8")
+    ).hexdigest()
+
+
 def _is_abspath(x: Any) -> bool:
     return isinstance(x, str) and os.path.isabs(x)
 
@@ -84,7 +192,14 @@ def _init_processor(
         errors.append("option %s: must be a string or a table" % str_option_path(*path))
 
     if name is not None:
-        proc = all_processors.get(name)
+        try:
+            proc = all_processors.get(name)
+        except Exception as e:
+            errors.append(
+                "option %s: cannot load processor %r: %s"
+                % (str_option_path(*path), name, e)
+            )
+            return None
         if proc is None:
             errors.append(
                 "option %s: unknown processor %r" % (str_option_path(*path), name)
@@ -98,6 +213,18 @@ def _init_processor(
     return None
 
 
+def _get_interval(errors: List[str], x: Any, path: ConfigPath) -> Optional[timedelta]:
+    try:
+        interval = parse_duration(x)
+    except ValueError as e:
+        errors.append("option %s: %s" % (str_option_path(*path), e))
+        return None
+    if interval <= timedelta():
+        errors.append("option %s: must be positive" % str_option_path(*path))
+        return None
+    return interval
+
+
 def _get_calendar_source(
     errors: List[str],
     x: Any,
@@ -105,6 +232,7 @@ def _get_calendar_source(
 ) -> Optional[CalendarSource]:
     url = None  # type: Optional[str]
     processors = []  # type: List
+    interval = None  # type: Optional[timedelta]
     if not isinstance(x, dict):
         errors.append("%s must be a table" % str_option_path(*path))
     else:
@@ -131,10 +259,142 @@ def _get_calendar_source(
                     % str_option_path(*path, "processors")
                 )
 
+        if "interval" in x:
+            interval = _get_interval(errors, x["interval"], (*path, "interval"))
+
     if url is None:
         return None
     else:
-        return CalendarSource(url=url, processors=processors)
+        return CalendarSource(
+            url=url,
+            processors=processors,
+            fingerprint=_fingerprint(x.get("processors", []), processors),
+            interval=interval,
+        )
+
+
+def _get_http_config(errors: List[str], x: Any, path: ConfigPath) -> HttpConfig:
+    http = HttpConfig()
+    if not isinstance(x, dict):
+        errors.append("option %s: must be a table" % str_option_path(*path))
+        return http
+
+    for option, value in x.items():
+        if option in ("limit", "limit_per_host", "dns_cache_ttl"):
+            if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+                setattr(http, option, value)
+            else:
+                errors.append(
+                    "option %s: must be a non-negative integer"
+                    % str_option_path(*path, option)
+                )
+        elif option in ("keepalive_timeout", "timeout"):
+            if (
+                isinstance(value, (int, float))
+                and not isinstance(value, bool)
+                and value >= 0
+            ):
+                setattr(http, option, value)
+            else:
+                errors.append(
+                    "option %s: must be a non-negative number of seconds"
+                    % str_option_path(*path, option)
+                )
+        else:
+            errors.append("unknown option %s" % str_option_path(*path, option))
+
+    return http
+
+
+def _get_output(
+    errors: List[str],
+    filename: str,
+    x: Any,
+    path: ConfigPath,
+    calendars: Dict[str, Any],
+) -> Optional[OutputConfig]:
+    if not isinstance(x, dict):
+        errors.append("option %s: must be a table" % str_option_path(*path))
+        return None
+    if os.path.basename(filename) != filename or filename.startswith("."):
+        errors.append(
+            "the option named %s must be a file name" % str_option_path(*path)
+        )
+
+    fmt = x.get("format", os.path.splitext(filename)[1][1:])
+    if fmt not in OUTPUT_FORMATS:
+        errors.append(
+            "option %s: must be one of %s"
+            % (
+                str_option_path(*path, "format"),
+                ", ".join(repr(x) for x in OUTPUT_FORMATS),
+            )
+        )
+        return None
+    output = _json_output() if fmt == "json" else OutputConfig(format=fmt)
+
+    for option in ("after", "before"):
+        if option in x:
+            try:
+                setattr(output, option, parse_duration(x[option]))
+            except ValueError as e:
+                errors.append("option %s: %s" % (str_option_path(*path, option), e))
+    if fmt == "ics" and ("after" in x) != ("before" in x):
+        errors.append(
+            "option %s: ICS outputs need both after and before or neither"
+            % str_option_path(*path)
+        )
+    elif (
+        output.after is not None
+        and output.before is not None
+        and output.after > output.before
+    ):
+        errors.append(
+            "option %s: must not be after %s"
+            % (str_option_path(*path, "after"), str_option_path(*path, "before"))
+        )
+
+    if "fields" in x:
+        if fmt != "json":
+            errors.append(
+                "option %s: only supported by JSON outputs"
+                % str_option_path(*path, "fields")
+            )
+        elif isinstance(x["fields"], list) and all(
+            f in DICT_EVENT_FIELDS for f in x["fields"]
+        ):
+            output.fields = x["fields"]
+        else:
+            errors.append(
+                "option %s: must be a list of %s"
+                % (
+                    str_option_path(*path, "fields"),
+                    ", ".join(repr(x) for x in DICT_EVENT_FIELDS),
+                )
+            )
+
+    if "calendars" in x:
+        if isinstance(x["calendars"], list) and all(
+            isinstance(c, str) for c in x["calendars"]
+        ):
+            output.calendars = x["calendars"]
+            for c in x["calendars"]:
+                if c not in calendars:
+                    errors.append(
+                        "option %s: unknown calendar %r"
+                        % (str_option_path(*path, "calendars"), c)
+                    )
+        else:
+            errors.append(
+                "option %s: must be a list of calendar names"
+                % str_option_path(*path, "calendars")
+            )
+
+    for option in x:
+        if option not in ("format", "after", "before", "fields", "calendars"):
+            errors.append("unknown option %s" % str_option_path(*path, option))
+
+    return output
 
 
 def load_config(name: Union[bytes, str]) -> Config:
@@ -145,6 +405,10 @@ def load_config(name: Union[bytes, str]) -> Config:
     calendars = {}  # type: Dict[str, CalendarSource]
     destmode = 0o644
     maxsize = 16 * 1024 * 1024
+    http = HttpConfig()
+    interval = timedelta(minutes=15)
+    workers = 0
+    outputs = default_outputs()
 
     for option in ("destdir", "workdir"):
         if option not in config:
@@ -164,6 +428,22 @@ def load_config(name: Union[bytes, str]) -> Config:
         except ValueError as e:
             errors.append("option %r: %s" % ("maxsize", e))
 
+    if "http" in config:
+        http = _get_http_config(errors, config["http"], ("http",))
+
+    if "interval" in config:
+        interval = _get_interval(errors, config["interval"], ("interval",)) or interval
+
+    if "workers" in config:
+        if (
+            isinstance(config["workers"], int)
+            and not isinstance(config["workers"], bool)
+            and config["workers"] >= 0
+        ):
+            workers = config["workers"]
+        else:
+            errors.append("option %r: must be a non-negative integer" % "workers")
+
     if "calendars" not in config:
         errors.append("missing option %r" % "calendars")
     elif not isinstance(config["calendars"], dict):
@@ -179,6 +459,25 @@ def load_config(name: Union[bytes, str]) -> Config:
             if calsrc is not None:
                 calendars[key] = calsrc
 
+    if "outputs" in config:
+        if isinstance(config["outputs"], dict):
+            known_calendars = config.get("calendars")
+            if not isinstance(known_calendars, dict):
+                known_calendars = {}
+            outputs = {}
+            for key, value in config["outputs"].items():
+                output = _get_output(
+                    errors,
+                    key,
+                    value,
+                    ("outputs", key),
+                    known_calendars,
+                )
+                if output is not None:
+                    outputs[key] = output
+        else:
+            errors.append("option %r: must be a table" % "outputs")
+
     if errors:
         errors.insert(0, "The config file %r contains following error(s):" % name)
         raise ConfigError("\n".join(errors))
@@ -189,4 +488,8 @@ def load_config(name: Union[bytes, str]) -> Config:
         destmode=destmode,
         maxsize=maxsize,
         calendars=calendars,
+        http=http,
+        interval=interval,
+        workers=workers,
+        outputs=outputs,
     )
@@ -17,6 +17,8 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import re
+from datetime import timedelta
 from typing import Any, Tuple, Union
 
 ConfigPath = Tuple[Union[int, str], ...]
@@ -56,5 +58,38 @@ def parse_size(x: Any) -> int:
         raise ValueError("must be string or integer")
 
 
+_DURATION_UNITS = {
+    "w": ("weeks", timedelta(weeks=1)),
+    "d": ("days", timedelta(days=1)),
+    "h": ("hours", timedelta(hours=1)),
+    "m": ("minutes", timedelta(minutes=1)),
+    "s": ("seconds", timedelta(seconds=1)),
+}
+_DURATION_RE = re.compile(r"([+-]?)((?:\d+(?:\.\d+)?[wdhms])+)")
+_DURATION_PART_RE = re.compile(r"(\d+(?:\.\d+)?)([wdhms])")
+
+
+def parse_duration(x: Any) -> timedelta:
+    if isinstance(x, (int, float)) and not isinstance(x, bool):
+        return timedelta(seconds=x)
+    elif isinstance(x, str):
+        m = _DURATION_RE.fullmatch(x.replace(" ", ""))
+        if m is None:
+            raise ValueError(
+                "number of seconds or string of numbers with one of these"
+                " suffixes expected %s"
+                % ", ".join(
+                    "%s (%s)" % (suffix, name)
+                    for suffix, (name, _) in _DURATION_UNITS.items()
+                )
+            )
+        duration = timedelta()
+        for value, unit in _DURATION_PART_RE.findall(m.group(2)):
+            duration += float(value) * _DURATION_UNITS[unit][1]
+        return -duration if m.group(1) == "-" else duration
+    else:
+        raise ValueError("must be string or number")
+
+
 def str_option_path(*path: Union[int, str]) -> str:
     return ".".join(repr(x) for x in path)
@@ -18,18 +18,36 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
 import asyncio
+import hashlib
+import json
 import logging
 import os
 import stat
 import tempfile
 from contextlib import asynccontextmanager
-from typing import AsyncIterator, BinaryIO, Optional, Tuple
+from http import HTTPStatus
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    Optional,
+    TypeVar,
+    cast,
+)
 
 import aiohttp
+from aiohttp import hdrs
 from icalendar import Calendar  # type: ignore
 
+from .util import replace_file
+
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 def add_exec_bit(mode: int) -> int:
     assert stat.S_IRUSR == stat.S_IXUSR << 2
@@ -50,6 +68,58 @@ def is_valid_ics(ical: bytes) -> bool:
         return False
 
 
+_VALIDATORS = {
+    hdrs.ETAG: hdrs.IF_NONE_MATCH,
+    hdrs.LAST_MODIFIED: hdrs.IF_MODIFIED_SINCE,
+}
+
+
+def _validators_path(dest: str) -> str:
+    return dest + ".validators"
+
+
+def _conditional_headers(dest: str) -> Dict[str, str]:
+    # only revalidate if we still have the local copy a 304 would refer to
+    if not os.path.exists(dest):
+        return {}
+    try:
+        with open(_validators_path(dest), "r", encoding="utf-8") as fp:
+            validators = json.load(fp)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError):
+        logger.warning("ignoring broken validator cache of %r", dest, exc_info=True)
+        return {}
+    headers = {}  # type: Dict[str, str]
+    if isinstance(validators, dict):
+        for validator, header in _VALIDATORS.items():
+            value = validators.get(validator)
+            if isinstance(value, str):
+                headers[header] = value
+    return headers
+
+
+def _save_validators(
+    dest: str,
+    resp: aiohttp.ClientResponse,
+    filemode: int,
+) -> None:
+    validators = dict(
+        (validator, resp.headers[validator])
+        for validator in _VALIDATORS
+        if validator in resp.headers
+    )
+    name = _validators_path(dest)
+    if not validators:
+        try:
+            os.unlink(name)
+        except FileNotFoundError:
+            pass
+        return
+    data = json.dumps(validators).encode("utf-8")
+    replace_file(name, filemode, lambda fp: fp.write(data))
+
+
 @asynccontextmanager
 async def _write_ics_to_disk(
     dest: str,
@@ -57,27 +127,34 @@ async def _write_ics_to_disk(
     maxsize: int,
     filemode: int,
     dirmode: int,
-) -> AsyncIterator[Tuple[str, int]]:
+    feed: Optional[Callable[[bytes], Any]] = None,
+) -> AsyncIterator[BinaryIO]:
+    if (
+        maxsize > 0
+        and resp.content_length is not None
+        and resp.content_length >= maxsize
+    ):
+        raise FileTooLargeError
     tmp = tempfile.NamedTemporaryFile(
         dir=os.path.dirname(dest),
         prefix=".tmp.",
     )
     try:
-        data = b""
+        # only count the bytes, the body is never held in memory as a whole
+        size = 0
         async for chunk in resp.content.iter_any():
-            data += chunk
-            if maxsize > 0 and len(data) >= maxsize:
+            size += len(chunk)
+            if maxsize > 0 and size >= maxsize:
                 raise FileTooLargeError
             tmp.write(chunk)
-
-        tmp.seek(0)
-        is_valid_ics(tmp.read())
+            if feed is not None:
+                feed(chunk)
 
         tmp.flush()
         os.chmod(tmp.fileno(), filemode)
         tmp.seek(0)
 
-        yield (tmp.name, tmp.fileno())
+        yield cast(BinaryIO, tmp)
     finally:
         # if everything is successful it will have been moved
         try:
@@ -86,9 +163,10 @@ async def _write_ics_to_disk(
             pass
 
 
-async def download_ics(
+async def download_calendar(
     url: str,
     directory: str,
+    parse: Callable[[BinaryIO, str], Awaitable[T]],
     *,
     filename: str = "calendar.ics",
     maxsize: int = 0,
@@ -96,12 +174,13 @@ async def download_ics(
     dirmode: Optional[int] = None,
     client: Optional[aiohttp.ClientSession] = None,
     loop: Optional[asyncio.AbstractEventLoop] = None,
-) -> BinaryIO:
+) -> T:
     if client is None:
         async with aiohttp.ClientSession() as client:
-            return await download_ics(
+            return await download_calendar(
                 url,
                 directory,
+                parse,
                 filename=filename,
                 maxsize=maxsize,
                 mode=mode,
@@ -115,32 +194,74 @@ async def download_ics(
     if loop is None:
         loop = asyncio.get_running_loop()
     dest = os.path.join(directory, filename)
-    async with client.get(url) as resp:
-        fd = -1
-        try:
-            resp.raise_for_status()
-            os.makedirs(directory, mode=dirmode, exist_ok=True)
-            async with _write_ics_to_disk(
-                dest,
-                resp,
-                maxsize=maxsize,
-                filemode=mode,
-                dirmode=dirmode,
-            ) as (name, tmpfd):
-                os.replace(name, dest)
-                fd = os.dup(tmpfd)
-        except BaseException:
-            logger.exception(
-                "failed to download %s, trying local file %r...",
-                url,
-                dest,
-            )
-        try:
-            return open(dest if fd < 0 else fd, "rb")
-        except BaseException:
-            if fd >= 0:
-                os.close(fd)
-            raise
+    try:
+        async with client.get(url, headers=_conditional_headers(dest)) as resp:
+            if resp.status == HTTPStatus.NOT_MODIFIED:
+                logger.debug("%s not modified, using local file %r", url, dest)
+            else:
+                resp.raise_for_status()
+                os.makedirs(directory, mode=dirmode, exist_ok=True)
+                digest = hashlib.sha256()
+                async with _write_ics_to_disk(
+                    dest,
+                    resp,
+                    maxsize=maxsize,
+                    filemode=mode,
+                    dirmode=dirmode,
+                    feed=digest.update,
+                ) as tmp:
+                    # parse before replacing, so a broken download never
+                    # overwrites the last good local copy
+                    result = await parse(tmp, digest.hexdigest())
+                    os.replace(tmp.name, dest)
+                _save_validators(dest, resp, filemode=mode)
+                return result
+    except Exception:
+        logger.exception(
+            "failed to download %s, trying local file %r...",
+            url,
+            dest,
+        )
+    with open(dest, "rb") as fp:
+        local_digest = hashlib.file_digest(fp, "sha256").hexdigest()
+        fp.seek(0)
+        return await parse(fp, local_digest)
+
+
+async def _reopen_if_valid(fp: BinaryIO, digest: str) -> BinaryIO:
+    if not is_valid_ics(fp.read()):
+        raise ValueError("%r is not a valid iCalendar file" % fp.name)
+    fp.seek(0)
+    fd = os.dup(fp.fileno())
+    try:
+        return open(fd, "rb")
+    except BaseException:
+        os.close(fd)
+        raise
+
+
+async def download_ics(
+    url: str,
+    directory: str,
+    *,
+    filename: str = "calendar.ics",
+    maxsize: int = 0,
+    mode: int = stat.S_IRUSR | stat.S_IWUSR,
+    dirmode: Optional[int] = None,
+    client: Optional[aiohttp.ClientSession] = None,
+    loop: Optional[asyncio.AbstractEventLoop] = None,
+) -> BinaryIO:
+    return await download_calendar(
+        url,
+        directory,
+        _reopen_if_valid,
+        filename=filename,
+        maxsize=maxsize,
+        mode=mode,
+        dirmode=dirmode,
+        client=client,
+        loop=loop,
+    )
 
 
 if __name__ == "__main__":
@@ -17,36 +17,61 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import hashlib
+import heapq
+import json
+import logging
+import os
+import stat
+import zoneinfo
+from bisect import bisect_left, bisect_right
 from collections.abc import Iterable
-from datetime import date, datetime, time, timezone
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, time, timedelta, timezone, tzinfo
+from functools import lru_cache
+from itertools import chain
+from operator import attrgetter, itemgetter
+from typing import Set  # noqa: F401
 from typing import (
     Any,
+    Callable,
     Dict,
     Iterator,
     List,
+    NamedTuple,
     NewType,
     Optional,
     Tuple,
     TypedDict,
     Union,
+    cast,
 )
 from zoneinfo import ZoneInfo
 
-from dateutil.rrule import rrulestr  # type: ignore
-from icalendar import Calendar, Event, Timezone  # type: ignore
+from dateutil.rrule import rruleset, rrulestr  # type: ignore
+from icalendar import Calendar, Event, Timezone, vDDDTypes  # type: ignore
 from icalendar.cal import Component  # type: ignore
 
+from .util import replace_file
+
+logger = logging.getLogger(__name__)
+
 PRODID = "-//icsmerge"
 
 
-class _DictEvent(TypedDict):
+class DictEvent(TypedDict, total=False):
     summary: str
     dtstart: str
-
-
-class DictEvent(_DictEvent, total=False):
+    dtend: str
     location: str
     url: str
+    description: str
+    uid: str
+
+
+DICT_EVENT_FIELDS = tuple(DictEvent.__annotations__)
+DEFAULT_DICT_EVENT_FIELDS = ("summary", "dtstart", "location", "url")
 
 
 def as_str(x: Union[bytes, str]) -> str:
@@ -57,9 +82,94 @@ def as_str(x: Union[bytes, str]) -> str:
         return x
 
 
+# Decoded property values of the current run over a calendar, see
+# memoize_decoded(). Entries are keyed by the raw value and keep it alive, so
+# replacing or deleting a property, which every write in icalendar does, makes
+# the next lookup miss.
+_decoded_values = ContextVar(
+    "_decoded_values", default=None
+)  # type: ContextVar[Optional[Dict[Tuple[str, int], Tuple[Any, Any]]]]
+
+
+@contextmanager
+def memoize_decoded() -> Iterator[None]:
+    if _decoded_values.get() is not None:
+        # already inside a run
+        yield
+        return
+    token = _decoded_values.set({})
+    try:
+        yield
+    finally:
+        _decoded_values.reset(token)
+
+
+def _decode(component: Component, name: str, value: Any) -> Any:
+    result = component._decode(name, value)
+    # icalendar decodes text to bytes, but every caller wants str
+    return as_str(result) if isinstance(result, bytes) else result
+
+
+def decode_value(component: Component, name: str, value: Any) -> Any:
+    memo = _decoded_values.get()
+    if memo is None:
+        return _decode(component, name, value)
+    key = (name.upper(), id(value))
+    try:
+        return memo[key][1]
+    except KeyError:
+        result = _decode(component, name, value)
+        memo[key] = (value, result)
+        return result
+
+
+_MISSING = object()
+
+
+def decoded(component: Component, name: str, default: Any = _MISSING) -> Any:
+    # like Component.decoded(), but memoized while in memoize_decoded()
+    try:
+        value = component[name]
+    except KeyError:
+        if default is _MISSING:
+            raise
+        return default
+    if isinstance(value, list):
+        return [decode_value(component, name, v) for v in value]
+    return decode_value(component, name, value)
+
+
+@lru_cache(maxsize=None)
+def get_zoneinfo(tzid: str) -> ZoneInfo:
+    # Failures are not cached, so this only holds the zones that exist.
+    return ZoneInfo(tzid)
+
+
+@lru_cache(maxsize=None)
+def tzdata_version() -> Optional[str]:
+    # the version of the zoneinfo database ZoneInfo loads zones from, the
+    # system's one is preferred over the tzdata package
+    for path in zoneinfo.TZPATH:
+        try:
+            with open(os.path.join(path, "tzdata.zi"), "r", encoding="utf-8") as fp:
+                line = fp.readline()
+        except OSError:
+            continue
+        if line.startswith("# version "):
+            return line.removeprefix("# version ").strip()
+    # importlib.metadata is slow to import, only needed without a system tzdata
+    import importlib.metadata
+
+    try:
+        return importlib.metadata.version("tzdata")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
 def decode_tz_aware(event: Event, property: str) -> Union[date, datetime, time]:
     value = event[property]
-    dt = event._decode(
+    dt = decode_value(
+        event,
         property,
         value[0] if isinstance(value, list) and value else value,
     )
@@ -69,12 +179,121 @@ def decode_tz_aware(event: Event, property: str) -> Union[date, datetime, time]:
         except KeyError:
             pass
         else:
-            dt = dt.replace(tzinfo=ZoneInfo(tzid))
+            dt = dt.replace(tzinfo=get_zoneinfo(tzid))
     elif not isinstance(dt, date):
         raise TypeError
     return dt
 
 
+@lru_cache(maxsize=4096)
+def _cached_rrule(
+    recur: str,
+    dtstart: Union[date, datetime],
+    tzinfo: Optional[tzinfo],
+) -> Any:
+    # cache=True also memoizes the occurrences already iterated over
+    return rrulestr(recur, dtstart=dtstart, cache=True)
+
+
+def _rrule_from_text(recur: str, dtstart: Union[date, datetime]) -> Any:
+    # Aware datetimes compare equal across timezones, but the occurrences
+    # follow dtstart's local time, so the timezone is part of the key.
+    return _cached_rrule(
+        recur,
+        dtstart,
+        dtstart.tzinfo if isinstance(dtstart, datetime) else None,
+    )
+
+
+def get_rrule(recur: Any, dtstart: Union[date, datetime]) -> Any:
+    return _rrule_from_text(as_str(recur.to_ical()), dtstart)
+
+
+def decode_tz_aware_list(event: Event, property: str) -> List[Union[date, datetime]]:
+    values = event.get(property, [])
+    dts = []  # type: List[Union[date, datetime]]
+    for value in values if isinstance(values, list) else [values]:
+        tzid = value.params.get("tzid")
+        for dt in value.dts:
+            dt = dt.dt
+            if isinstance(dt, tuple):
+                # PERIOD, only its start is relevant
+                dt = dt[0]
+            if isinstance(dt, datetime) and tzid is not None:
+                dt = dt.replace(tzinfo=get_zoneinfo(tzid))
+            if isinstance(dt, date):
+                dts.append(dt)
+    return dts
+
+
+def _as_rrule_datetime(
+    dt: Union[date, datetime],
+    dtstart: Union[date, datetime],
+) -> datetime:
+    # rrule yields naive datetimes for DATE and floating DTSTARTs
+    if not isinstance(dt, datetime):
+        dt = datetime.combine(dt, time.min)
+    if not isinstance(dtstart, datetime) or dtstart.tzinfo is None:
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    elif dt.tzinfo is None:
+        dt = dt.replace(tzinfo=dtstart.tzinfo)
+    return dt
+
+
+def _as_rrule_bound(dt: datetime, dtstart: Union[date, datetime]) -> datetime:
+    if not isinstance(dtstart, datetime):
+        # the whole day counts
+        return datetime.combine(dt.date(), time.min)
+    elif dtstart.tzinfo is None:
+        # floating, compare as if it were UTC
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    else:
+        return dt
+
+
+def _rrule_texts(event: Event) -> Tuple[str, ...]:
+    recur = event.get("rrule", [])
+    if not isinstance(recur, list):
+        recur = [recur]
+    return tuple(as_str(rrule.to_ical()) for rrule in recur)
+
+
+def _rruleset(
+    dtstart: Union[date, datetime],
+    rrules: Iterable[str],
+    rdates: Iterable[Union[date, datetime]],
+    exdates: Iterable[Union[date, datetime]],
+) -> Any:
+    rset = rruleset(cache=True)
+    # DTSTART is always the first occurrence, even if the RRULE does not match
+    rset.rdate(_as_rrule_datetime(dtstart, dtstart))
+    for rrule in rrules:
+        rset.rrule(_rrule_from_text(rrule, dtstart))
+    for rdate in rdates:
+        rset.rdate(_as_rrule_datetime(rdate, dtstart))
+    for exdate in exdates:
+        rset.exdate(_as_rrule_datetime(exdate, dtstart))
+    return rset
+
+
+def get_rruleset(
+    event: Event,
+    dtstart: Union[date, datetime],
+    exclude: Iterable[Union[date, datetime]] = (),
+) -> Any:
+    rrules = _rrule_texts(event)
+    rdates = decode_tz_aware_list(event, "rdate")
+    if not rrules and not rdates:
+        return None
+    return _rruleset(
+        dtstart,
+        rrules,
+        rdates,
+        chain(decode_tz_aware_list(event, "exdate"), exclude),
+    )
+
+
 def iter_property_items(
     component: Component,
     recursive: bool = True,
@@ -86,52 +305,6 @@ def iter_property_items(
             yield from iter_property_items(subcomponent)
 
 
-def list_of_dict_events(
-    cal: Calendar,
-    after: datetime,
-    before: datetime,
-) -> List[DictEvent]:
-    events = []  # type: List[DictEvent]
-    for vevent in cal.walk("vevent"):
-        try:
-            summary = as_str(vevent.decoded("summary"))
-            dtstart = decode_tz_aware(vevent, "dtstart")
-        except KeyError:
-            continue
-        location = as_str(vevent.decoded("location", ""))
-        url = as_str(vevent.decoded("url", ""))
-
-        if isinstance(dtstart, time):
-            continue
-        else:
-            assert isinstance(dtstart, (date, datetime))
-
-        try:
-            recur = vevent["rrule"]
-        except KeyError:
-            # yes, inclusive, see rrule.between()
-            if dtstart < (after if isinstance(dtstart, datetime) else after.date()):
-                continue
-            if dtstart > (before if isinstance(dtstart, datetime) else before.date()):
-                continue
-            dtstarts = [dtstart]  # type: Iterable[Union[date, datetime]]
-        else:
-            rrule = rrulestr(as_str(recur.to_ical()), dtstart=dtstart)
-            dtstarts = rrule.between(after, before, inc=True)
-
-        for dtstart in dtstarts:
-            ev = DictEvent(
-                summary=summary,
-                dtstart=dtstart.isoformat(),
-            )
-            if location:
-                ev["location"] = location
-            if url:
-                ev["url"] = url
-            events.append(ev)
-    return events
-
-
 def get_dtend(event: Event) -> Union[date, datetime, time]:
     try:
         dtend = decode_tz_aware(event, "dtend")
@@ -139,7 +312,7 @@ def get_dtend(event: Event) -> Union[date, datetime, time]:
         dtstart = decode_tz_aware(event, "dtstart")
         if isinstance(dtstart, list) and dtstart:
             dtstart = dtstart[0]
-        duration = event.decoded("duration")
+        duration = decoded(event, "duration")
         if isinstance(duration, list) and duration:
             duration = duration[0]
         dtend = dtstart + duration
@@ -148,59 +321,450 @@ def get_dtend(event: Event) -> Union[date, datetime, time]:
     return dtend
 
 
-def _with_dtstart(event: Event) -> Tuple[Union[None, datetime], Event]:
-    dtstart = None  # type: Optional[datetime]
+def _rrule_has_passed(recur: str, limit: datetime) -> Optional[bool]:
+    # Decide from UNTIL and COUNT alone whether all occurrences start before
+    # limit. None means the occurrences have to be iterated.
+    parts = dict(part.partition("=")[::2] for part in recur.upper().split(";"))
+    if "UNTIL" not in parts and "COUNT" not in parts:
+        # open-ended series never pass
+        return False
+    try:
+        until = vDDDTypes.from_ical(parts["UNTIL"])  # type: ignore[no-untyped-call]
+    except (KeyError, ValueError):
+        return None
+    if isinstance(until, datetime) and until.tzinfo is not None:
+        return True if until < limit else None
+    elif isinstance(until, date):
+        # floating, so allow for any UTC offset
+        if not isinstance(until, datetime):
+            until = datetime.combine(until, time.max)
+        if until.replace(tzinfo=timezone.utc) + timedelta(days=1) < limit:
+            return True
+    return None
+
+
+def _walk_events(cal: Calendar) -> List[Event]:
+    # icalendar only promises plain components
+    return cast(List[Event], cal.walk("vevent"))
+
+
+def _decoded_str(event: Event, property: str) -> Optional[str]:
     try:
-        decoded = decode_tz_aware(event, "dtstart")
+        return as_str(decoded(event, property))
     except KeyError:
-        pass
-    else:
-        if isinstance(decoded, datetime):
-            dtstart = decoded
-        elif isinstance(decoded, date):
-            dtstart = datetime.combine(decoded, time.min)
+        return None
+
+
+# Everything sorting, pruning, merging and exporting need to know about a
+# VEVENT, decoded once. None stands for missing or malformed properties.
+class EventRecord:
+    __slots__ = (
+        "event",
+        "start",
+        "end",
+        "key",
+        "rrule",
+        "rdate",
+        "exdate",
+        "uid",
+        "recurrence_id",
+        "cancelled",
+        "_texts",
+    )
+
+    def __init__(self, event: Event):
+        self.event = event
+        start = None  # type: Optional[Union[date, datetime]]
+        try:
+            dt = decode_tz_aware(event, "dtstart")
+        except (KeyError, TypeError):
+            pass
         else:
-            raise TypeError
-    return (dtstart, event)
+            # we don't know how to proceed with time events
+            if not isinstance(dt, time):
+                start = dt
+        self.start = start
+
+        end = None  # type: Optional[Union[date, datetime, time]]
+        try:
+            end = decode_tz_aware(event, "dtend")
+        except KeyError:
+            if start is not None:
+                try:
+                    duration = decoded(event, "duration")
+                except KeyError:
+                    pass
+                else:
+                    if isinstance(duration, list) and duration:
+                        duration = duration[0]
+                    end = start + duration
+        except TypeError:
+            pass
+        self.end = end
+
+        # one instant for all kinds of starts, so events sort and merge
+        # chronologically
+        self.key = None if start is None else _utc_sort_key(start)
+
+        self.rrule = _rrule_texts(event)
+        self.rdate = decode_tz_aware_list(event, "rdate")
+        self.exdate = decode_tz_aware_list(event, "exdate")
+
+        recurrence_id = None  # type: Optional[Union[date, datetime]]
+        if "recurrence-id" in event:
+            try:
+                dt = decode_tz_aware(event, "recurrence-id")
+            except TypeError:
+                pass
+            else:
+                if not isinstance(dt, time):
+                    recurrence_id = dt
+        self.recurrence_id = recurrence_id
+
+        self.uid = _decoded_str(event, "uid")
+        self.cancelled = (_decoded_str(event, "status") or "").upper() == "CANCELLED"
+        self._texts = None  # type: Optional[Dict[str, Optional[str]]]
+
+    # The exported text properties are only decoded once they are asked for,
+    # most outputs never look at all of them.
+    def _text(self, property: str) -> Optional[str]:
+        if self._texts is None:
+            self._texts = {}
+        try:
+            return self._texts[property]
+        except KeyError:
+            value = self._texts[property] = _decoded_str(self.event, property)
+            return value
+
+    @property
+    def summary(self) -> Optional[str]:
+        return self._text("summary")
+
+    @property
+    def location(self) -> Optional[str]:
+        return self._text("location")
+
+    @property
+    def url(self) -> Optional[str]:
+        return self._text("url")
+
+    @property
+    def description(self) -> Optional[str]:
+        return self._text("description")
+
+    # Records are views of their VEVENT, so two records of the same VEVENT are
+    # interchangeable.
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, EventRecord):
+            return NotImplemented
+        return self.event is other.event
+
+    def __hash__(self) -> int:
+        return id(self.event)
+
+    @property
+    def is_recurring(self) -> bool:
+        return bool(self.rrule or self.rdate)
+
+    def rruleset(self, exclude: Iterable[Union[date, datetime]] = ()) -> Any:
+        if self.start is None or not self.is_recurring:
+            return None
+        return _rruleset(
+            self.start,
+            self.rrule,
+            self.rdate,
+            chain(self.exdate, exclude),
+        )
+
+    def has_passed(self, now: Optional[datetime] = None) -> bool:
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        dtend = self.end
+        if dtend is None:
+            # keep malformed events
+            return False
+        if isinstance(dtend, time) or _as_rrule_datetime(
+            dtend, dtend
+        ) >= _as_rrule_bound(now, dtend):
+            return False
+
+        dtstart = self.start
+        if dtstart is None:
+            # keep malformed and time events
+            return False
+
+        if not self.is_recurring:
+            return True
+        duration = dtend - dtstart
+        limit = now - duration
+        passed = None  # type: Optional[bool]
+        if self.rrule:
+            results = [_rrule_has_passed(rrule, limit) for rrule in self.rrule]
+            if False in results:
+                passed = False
+            elif all(results):
+                passed = True
+        # RDATEs can add occurrences after UNTIL
+        if passed is False or (passed is True and not self.rdate):
+            return passed
+        # rrule converts dtstart to datetime, so we don't have to handle dates like above
+        rset = self.rruleset()
+        if rset.after(_as_rrule_bound(limit, dtstart), inc=True) is not None:
+            return False
+
+        return True
 
 
 def event_has_passed(
     event: Event,
     now: Optional[datetime] = None,
 ) -> bool:
+    return EventRecord(event).has_passed(now)
+
+
+class Occurrence(NamedTuple):
+    start: Union[date, datetime]
+    record: EventRecord
+
+    @property
+    def event(self) -> Event:
+        return self.record.event
+
+
+def _utc_sort_key(dt: Union[date, datetime]) -> datetime:
+    if not isinstance(dt, datetime):
+        dt = datetime.combine(dt, time.min)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+# Groups the VEVENTs of a calendar by UID, so occurrences overridden by a
+# VEVENT with RECURRENCE-ID are not generated by their master event as well.
+# Occurrences are kept in sorted arrays, all-day ones by date and all others by
+# their UTC start, so a window is found by bisection. Series are expanded
+# lazily over whole UTC days and the expanded range only ever grows.
+class OccurrenceIndex:
+    def __init__(self, cal: Union[Calendar, Iterable[EventRecord]]):
+        self._timed_keys = []  # type: List[datetime]
+        self._timed = []  # type: List[Occurrence]
+        self._day_keys = []  # type: List[date]
+        self._days = []  # type: List[Occurrence]
+        self._series = []  # type: List[Tuple[Union[date, datetime], Any, EventRecord]]
+        self._expanded = None  # type: Optional[Tuple[datetime, datetime]]
+        if isinstance(cal, Calendar):
+            cal = map(EventRecord, _walk_events(cal))
+        single = []  # type: List[Occurrence]
+        masters = []  # type: List[Tuple[Union[date, datetime], EventRecord]]
+        overridden = {}  # type: Dict[str, List[Union[date, datetime]]]
+        for record in cal:
+            dtstart = record.start
+            if dtstart is None:
+                continue
+            if "recurrence-id" not in record.event:
+                masters.append((dtstart, record))
+                continue
+            if record.uid is not None and record.recurrence_id is not None:
+                overridden.setdefault(record.uid, []).append(record.recurrence_id)
+            if not record.cancelled:
+                single.append(Occurrence(dtstart, record))
+
+        for dtstart, record in masters:
+            rset = record.rruleset(
+                exclude=() if record.uid is None else overridden.get(record.uid, ()),
+            )
+            if rset is None:
+                single.append(Occurrence(dtstart, record))
+            else:
+                self._series.append((dtstart, rset, record))
+        self._insert(single)
+
+    def _insert(self, occurrences: List[Occurrence]) -> None:
+        timed = self._timed
+        days = self._days
+        for occurrence in occurrences:
+            if isinstance(occurrence.start, datetime):
+                timed.append(occurrence)
+            else:
+                days.append(occurrence)
+        # mostly sorted already, so this is close to linear
+        timed.sort(key=lambda x: _utc_sort_key(x.start))
+        days.sort(key=itemgetter(0))
+        self._timed_keys = [_utc_sort_key(x.start) for x in timed]
+        self._day_keys = [x.start for x in days]
+
+    def _expand(self, lower: datetime, upper: datetime) -> None:
+        # expand all series over [lower, upper)
+        occurrences = []  # type: List[Occurrence]
+        for dtstart, rset, record in self._series:
+            stop = _as_rrule_bound(upper, dtstart)
+            for start in rset.between(
+                _as_rrule_bound(lower, dtstart),
+                stop,
+                inc=True,
+            ):
+                if start == stop:
+                    continue
+                if not isinstance(dtstart, datetime):
+                    start = start.date()
+                occurrences.append(Occurrence(start, record))
+        self._insert(occurrences)
+
+    def _ensure_expanded(self, after: datetime, before: datetime) -> None:
+        if not self._series:
+            return
+        # cover the days of both the local and the UTC bounds, all-day
+        # occurrences are matched by the former
+        first = min(after.date(), after.astimezone(timezone.utc).date())
+        last = max(before.date(), before.astimezone(timezone.utc).date())
+        lower = datetime.combine(first, time.min, timezone.utc)
+        upper = datetime.combine(last, time.min, timezone.utc) + timedelta(days=1)
+        if self._expanded is None:
+            self._expand(lower, upper)
+            self._expanded = (lower, upper)
+            return
+        expanded_lower, expanded_upper = self._expanded
+        if lower < expanded_lower:
+            self._expand(lower, expanded_lower)
+            expanded_lower = lower
+        if upper > expanded_upper:
+            self._expand(expanded_upper, upper)
+            expanded_upper = upper
+        self._expanded = (expanded_lower, expanded_upper)
+
+    def between(self, after: datetime, before: datetime) -> List[Occurrence]:
+        # yes, inclusive, see rrule.between()
+        self._ensure_expanded(after, before)
+        lo = bisect_left(self._timed_keys, after)
+        hi = bisect_right(self._timed_keys, before)
+        timed = self._timed[lo:hi]
+        lo = bisect_left(self._day_keys, after.date())
+        hi = bisect_right(self._day_keys, before.date())
+        days = self._days[lo:hi]
+        if not days:
+            return timed
+        return list(heapq.merge(timed, days, key=lambda x: _utc_sort_key(x.start)))
+
+
+def _dict_event(
+    occurrence: Occurrence,
+    fields: Iterable[str],
+) -> Optional[DictEvent]:
+    dtstart, record = occurrence
+    summary = record.summary
+    if summary is None:
+        return None
+
+    ev = DictEvent()
+    for field in fields:
+        if field == "summary":
+            ev["summary"] = summary
+        elif field == "dtstart":
+            ev["dtstart"] = dtstart.isoformat()
+        elif field == "dtend":
+            dtend = record.end
+            if dtend is None or isinstance(dtend, time) or record.start is None:
+                continue
+            ev["dtend"] = (dtstart + (dtend - record.start)).isoformat()
+        else:
+            value = getattr(record, field)
+            if value:
+                ev[field] = value  # type: ignore
+    return ev
+
+
+def list_of_dict_events(
+    cal: Union[Calendar, OccurrenceIndex],
+    after: datetime,
+    before: datetime,
+    *,
+    fields: Iterable[str] = DEFAULT_DICT_EVENT_FIELDS,
+    include: Optional[Callable[[Event], bool]] = None,
+) -> List[DictEvent]:
+    index = cal if isinstance(cal, OccurrenceIndex) else OccurrenceIndex(cal)
+    fields = tuple(fields)
+    events = []  # type: List[DictEvent]
+    for occurrence in index.between(after, before):
+        if include is not None and not include(occurrence.event):
+            continue
+        ev = _dict_event(occurrence, fields)
+        if ev is not None:
+            events.append(ev)
+    return events
+
+
+def occurs_between(
+    index: OccurrenceIndex,
+    after: datetime,
+    before: datetime,
+) -> Callable[[Event], bool]:
+    # Once a series occurs in the window, all of its overrides are kept as
+    # well, so cancelled and moved occurrences still apply.
+    occurring = set()  # type: Set[int]
+    uids = set()  # type: Set[str]
+    for occurrence in index.between(after, before):
+        occurring.add(id(occurrence.event))
+        if occurrence.record.uid is not None:
+            uids.add(occurrence.record.uid)
+
+    def include(event: Event) -> bool:
+        if id(event) in occurring:
+            return True
+        return "recurrence-id" in event and as_str(event.get("uid", "")) in uids
+
+    return include
+
+
+def prune_and_sort(cal: Calendar, now: Optional[datetime] = None) -> Calendar:
+    # events never stop having passed, so the result stays valid later on
+    prune_and_sort_records(cal, now)
+    return cal
+
+
+def prune_and_sort_records(
+    cal: Calendar,
+    now: Optional[datetime] = None,
+) -> List[EventRecord]:
+    # Same as prune_and_sort(), but returns the records of the kept events, so
+    # IncrementalMerge.update() does not have to decode them again.
     if now is None:
         now = datetime.now(timezone.utc)
+    events = [c for c in cal.subcomponents if c.name == "VEVENT"]
+    subcomponents = [
+        c for c in cal.subcomponents if c.name != "VEVENT"
+    ]  # type: List[Component]
+    records = _sorted_records(cast(List[Event], events), now)
+    subcomponents.extend(record.event for record in records)
+    cal.subcomponents[:] = subcomponents
+    return records
 
-    try:
-        dtend = get_dtend(event)
-    except (KeyError, TypeError):
-        # keep malformed events
-        return False
-    if isinstance(dtend, time) or dtend >= (
-        now if isinstance(dtend, datetime) else now.date()
-    ):
-        return False
 
-    try:
-        dtstart = decode_tz_aware(event, "dtstart")
-    except KeyError:
-        # keep malformed events
-        return False
-    if not isinstance(dtstart, (date, datetime)):
-        # we don't know how to proceed with time events, so keep them
-        return False
+def _pruned_records(records: Iterable[EventRecord], now: datetime) -> List[EventRecord]:
+    # VEVENTs with RECURRENCE-ID are kept as long as their master is, even if
+    # they have passed, otherwise the master would bring back the occurrences
+    # they moved or cancelled.
+    records = list(records)
+    passed = [r.has_passed(now) for r in records]
+    masters = set(
+        r.uid
+        for r, p in zip(records, passed)
+        if not p and r.uid is not None and "recurrence-id" not in r.event
+    )
+    return [
+        r
+        for r, p in zip(records, passed)
+        if not p or ("recurrence-id" in r.event and r.uid in masters)
+    ]
 
-    try:
-        recur = event["rrule"]
-    except KeyError:
-        return True
-    # rrule converts dtstart to datetime, so we don't have to handle dates like above
-    rrule = rrulestr(as_str(recur.to_ical()), dtstart=dtstart)
-    duration = dtend - dtstart
-    if rrule.after(now - duration, inc=True) is not None:
-        return False
 
-    return True
+def _sorted_records(events: Iterable[Event], now: datetime) -> List[EventRecord]:
+    records = (EventRecord(event) for event in events)
+    # sorted() is stable, so events starting at the same time keep their order
+    return sorted(
+        _pruned_records((r for r in records if r.key is not None), now),
+        key=attrgetter("key"),
+    )
 
 
 def sorted_events(
@@ -210,101 +774,382 @@ def sorted_events(
 ) -> List[Event]:
     if now is None:
         now = datetime.now(timezone.utc)
-    events_with_dtstart = (
-        (
-            # so we never compare localized and non-localized datetime
-            dtstart.tzinfo is not None,
-            dtstart,
-            # so we never compare icalendar.Event
-            i,
-            event,
-        )
-        for i, (dtstart, event) in enumerate(map(_with_dtstart, events))
-        if dtstart is not None and not event_has_passed(event, now)
-    )
-    return [ev for _, _, _, ev in sorted(events_with_dtstart)]
+    return [record.event for record in _sorted_records(events, now)]
 
 
 TZID = NewType("TZID", str)
 
 
-def timezones_by_tzid(timezones: Iterable[Timezone]) -> Dict[TZID, Timezone]:
-    by_tzid = {}  # type: Dict[TZID, Timezone]
+def _timezone_definitions(timezones: Iterable[Timezone]) -> Dict[TZID, List[Timezone]]:
+    by_tzid = {}  # type: Dict[TZID, List[Timezone]]
     for tz in timezones:
         try:
-            tzid = tz.decoded("tzid")
+            tzid = decoded(tz, "tzid")
         except KeyError:
             continue
         if isinstance(tzid, list):
             if not tzid:
                 continue
             tzid = tzid[0]
-        saved_tz = by_tzid.setdefault(TZID(as_str(tzid)), tz)
-        if saved_tz is not tz:
-            # two timezones definitions with the same TZID found
-            pass  # TODO see if the same
+        by_tzid.setdefault(TZID(as_str(tzid)), []).append(tz)
     return by_tzid
 
 
+def timezones_by_tzid(timezones: Iterable[Timezone]) -> Dict[TZID, Timezone]:
+    # the first definition of a TZID wins
+    return dict(
+        (tzid, definitions[0])
+        for tzid, definitions in _timezone_definitions(timezones).items()
+    )
+
+
 def get_used_timezones(
     event: Event,
     timezones: Dict[TZID, Timezone],
 ) -> Dict[TZID, Timezone]:
-    tzids = {}  # type: Dict[TZID, Timezone]
+    return dict((tzid, timezones[tzid]) for tzid in _used_tzids(event))
+
+
+def _used_tzids(event: Event) -> Iterator[TZID]:
     for _, prop, value in iter_property_items(event):
         for value in value if isinstance(value, list) else [value]:
             try:
                 tzid = value.params["tzid"]
             except KeyError:
                 continue
-            tzid = TZID(as_str(tzid))
-            tzids[tzid] = timezones[tzid]
-    return tzids
+            yield TZID(as_str(tzid))
 
 
-def merge(
-    calendars: Iterable[Calendar],
-    *,
-    prodid: Union[bytes, str] = PRODID,
-    now: Optional[datetime] = None,
-) -> Calendar:
-    if now is None:
-        now = datetime.now(timezone.utc)
-    events = []  # type: List[Event]
-    timezones = {}  # type: Dict[TZID, Timezone]
-    for cal in calendars:
-        calendar_events = sorted_events(
-            cal.walk("vevent"),
-            now=now,
+def _transition_samples(
+    vtimezone: Timezone,
+    lower: datetime,
+    upper: datetime,
+) -> Iterator[Tuple[datetime, timedelta]]:
+    # naive UTC instants in [lower, upper) and the UTC offset the VTIMEZONE
+    # defines for them: the start, middle and end of every period between two
+    # transitions
+    times, infos = vtimezone.get_transitions()
+    for i, start in enumerate(times):
+        end = times[i + 1] if i + 1 < len(times) else upper
+        start = max(start, lower)
+        end = min(end, upper)
+        if start >= end:
+            continue
+        offset = infos[i][0]
+        yield (start, offset)
+        yield (start + (end - start) / 2, offset)
+        yield (end - timedelta(seconds=1), offset)
+
+
+# Resolves TZIDs to the system's zoneinfo and checks if the VTIMEZONE
+# definitions of the sources agree with it, datetimes are always interpreted
+# with the former. The definitions are fingerprinted, so every distinct one
+# is only compared once and the results are kept on disk for later runs. The
+# results only hold for one tzdata version and one comparison window, they
+# are all dropped when either changes.
+class TimezoneRegistry:
+    # only compare the UTC offsets of these years around now
+    YEARS_BEFORE = 1
+    YEARS_AFTER = 2
+    # bump when the comparison changes
+    VERSION = 1
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        *,
+        mode: int = stat.S_IRUSR | stat.S_IWUSR,
+        now: Optional[datetime] = None,
+    ):
+        self.path = path
+        self.mode = mode
+        self._now = now
+        self._validity = self._current_validity()
+        self._verified = {}  # type: Dict[str, bool]
+        self._dirty = False
+        if path is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as fp:
+                    cached = json.load(fp)
+            except FileNotFoundError:
+                cached = {}
+            except (OSError, ValueError):
+                logger.warning("ignoring broken timezone cache %r", path, exc_info=True)
+                cached = {}
+            if (
+                isinstance(cached, dict)
+                and cached.get("valid_for") == self._validity
+                and isinstance(cached.get("verified"), dict)
+            ):
+                self._verified.update(
+                    (k, v) for k, v in cached["verified"].items() if isinstance(v, bool)
+                )
+
+    @property
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc) if self._now is None else self._now
+
+    def _current_validity(self) -> List[Any]:
+        # a list to compare equal to what was loaded from JSON
+        return [self.VERSION, tzdata_version(), self.now.year]
+
+    @staticmethod
+    def fingerprint(tzid: TZID, vtimezone: Timezone) -> str:
+        h = hashlib.sha256()
+        h.update(tzid.encode("utf-8", "surrogateescape"))
+        h.update(b"\0")
+        h.update(vtimezone.to_ical())
+        return h.hexdigest()
+
+    def _matches_zoneinfo(self, tzid: TZID, vtimezone: Timezone) -> bool:
+        try:
+            zone = get_zoneinfo(tzid)
+        except (KeyError, ValueError):
+            # ZoneInfoNotFoundError is a KeyError
+            return False
+        now = self.now.astimezone(timezone.utc).replace(tzinfo=None)
+        try:
+            samples = list(
+                _transition_samples(
+                    vtimezone,
+                    now - timedelta(days=366 * self.YEARS_BEFORE),
+                    now + timedelta(days=366 * self.YEARS_AFTER),
+                )
+            )
+        except Exception:
+            logger.debug("cannot decode VTIMEZONE %r", tzid, exc_info=True)
+            return False
+        return bool(samples) and all(
+            dt.replace(tzinfo=timezone.utc).astimezone(zone).utcoffset() == offset
+            for dt, offset in samples
         )
 
-        all_calendar_timezones = timezones_by_tzid(cal.walk("vtimezone"))
-        for event in calendar_events:
-            for tzid, vtimezone in get_used_timezones(
-                event,
-                all_calendar_timezones,
-            ).items():
-                tz = ZoneInfo(tzid)
-                # We use the system's zoneinfo instead of decoding VTIMEZONE,
-                # so we should ensure they are the same.
-                # TODO assert vtimezone == tz
-                saved_vtimezone = timezones.setdefault(tzid, vtimezone)
-                if saved_vtimezone is not vtimezone:
-                    pass  # TODO assert saved_vtimezone == vtimezone
-
-        events.extend(calendar_events)
+    def verify(self, tzid: TZID, vtimezone: Timezone) -> bool:
+        validity = self._current_validity()
+        if validity != self._validity:
+            # a new year in daemon mode, compare everything again
+            self._validity = validity
+            self._verified.clear()
+            self._dirty = True
+        fingerprint = self.fingerprint(tzid, vtimezone)
+        try:
+            return self._verified[fingerprint]
+        except KeyError:
+            pass
+        verified = self._matches_zoneinfo(tzid, vtimezone)
+        if not verified:
+            logger.warning("VTIMEZONE %r does not match the system's zoneinfo", tzid)
+        self._verified[fingerprint] = verified
+        self._dirty = True
+        return verified
+
+    def used_timezones(
+        self,
+        cal: Calendar,
+        events: Iterable[Event],
+    ) -> Dict[TZID, Tuple[Timezone, bool]]:
+        # in order of first use
+        tzids = {}  # type: Dict[TZID, None]
+        for event in events:
+            tzids.update(dict.fromkeys(_used_tzids(event)))
+        if not tzids:
+            return {}
+        definitions = _timezone_definitions(cast(List[Timezone], cal.walk("vtimezone")))
+        timezones = {}  # type: Dict[TZID, Tuple[Timezone, bool]]
+        for tzid in tzids:
+            if tzid not in definitions:
+                logger.warning("no VTIMEZONE for TZID %r", tzid)
+                continue
+            for vtimezone in definitions[tzid]:
+                verified = self.verify(tzid, vtimezone)
+                _add_timezone(timezones, tzid, vtimezone, verified)
+        return timezones
+
+    def save(self) -> None:
+        if self.path is None or not self._dirty:
+            return
+        data = json.dumps({"valid_for": self._validity, "verified": self._verified})
+        replace_file(self.path, self.mode, lambda fp: fp.write(data.encode("utf-8")))
+        self._dirty = False
+
+
+def _add_timezone(
+    timezones: Dict[TZID, Tuple[Timezone, bool]],
+    tzid: TZID,
+    vtimezone: Timezone,
+    verified: bool,
+) -> None:
+    # keep the first definition, unless a later one matches the system's
+    # zoneinfo and it does not
+    saved = timezones.get(tzid)
+    if saved is None or (verified and not saved[1]):
+        timezones[tzid] = (vtimezone, verified)
 
+
+def _merged_calendar(
+    prodid: Union[bytes, str],
+    timezones: Iterable[Timezone],
+    events: Iterable[Event],
+) -> Calendar:
     merged = Calendar()
     merged.add("prodid", prodid)
     merged.add("version", "2.0")
-    for vtimezone in timezones.values():
+    for vtimezone in timezones:
         merged.add_component(vtimezone)
     for event in events:
         merged.add_component(event)
-
     return merged
 
 
+_END_VCALENDAR = b"END:VCALENDAR\r\n"
+
+
+def _iter_ical(cal: Calendar, subcomponents: Iterable[bytes]) -> Iterator[bytes]:
+    # serialize the properties of the calendar without its subcomponents
+    head = Calendar()
+    head.update(cal)
+    ical = head.to_ical()
+    assert ical.endswith(_END_VCALENDAR)
+    yield ical[: -len(_END_VCALENDAR)]
+    yield from subcomponents
+    yield _END_VCALENDAR
+
+
+def iter_ical(cal: Calendar) -> Iterator[bytes]:
+    # Same as cal.to_ical(), but one subcomponent at a time, so the whole
+    # calendar is never held in memory at once.
+    return _iter_ical(cal, (c.to_ical() for c in cal.subcomponents))
+
+
+# Keeps the sorted and pruned events of every source, so a changed source can
+# be swapped in without touching the others.
+class IncrementalMerge:
+    def __init__(
+        self,
+        *,
+        prodid: Union[bytes, str] = PRODID,
+        timezones: Optional[TimezoneRegistry] = None,
+    ):
+        self.prodid = prodid
+        self.timezones = TimezoneRegistry() if timezones is None else timezones
+        self._events = {}  # type: Dict[str, List[EventRecord]]
+        self._timezones = {}  # type: Dict[str, Dict[TZID, Tuple[Timezone, bool]]]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._events
+
+    def update(
+        self,
+        name: str,
+        cal: Calendar,
+        *,
+        now: Optional[datetime] = None,
+        records: Optional[List[EventRecord]] = None,
+    ) -> None:
+        # records from prune_and_sort_records() are taken as they are
+        if records is None:
+            if now is None:
+                now = datetime.now(timezone.utc)
+            records = _sorted_records(_walk_events(cal), now)
+        self._events[name] = records
+        self._timezones[name] = self.timezones.used_timezones(
+            cal, (r.event for r in records)
+        )
+
+    def remove(self, name: str) -> None:
+        del self._events[name]
+        del self._timezones[name]
+
+    def prune(self, now: Optional[datetime] = None) -> None:
+        if now is None:
+            now = datetime.now(timezone.utc)
+        for name, records in self._events.items():
+            pruned = _pruned_records(records, now)
+            if len(pruned) == len(records):
+                continue
+            self._events[name] = pruned
+            # drop the VTIMEZONEs only the pruned events used
+            used = set(chain.from_iterable(_used_tzids(r.event) for r in pruned))
+            self._timezones[name] = dict(
+                (tzid, x) for tzid, x in self._timezones[name].items() if tzid in used
+            )
+
+    def records(self, names: Optional[Iterable[str]] = None) -> Iterator[EventRecord]:
+        # Every source is already sorted, so lazily k-way merge them into one
+        # chronological stream in O(n log k).
+        if names is None:
+            names = self._events
+        sources = [self._events[name] for name in names]
+        return heapq.merge(*sources, key=attrgetter("key"))
+
+    def events(self, names: Optional[Iterable[str]] = None) -> Iterator[Event]:
+        for record in self.records(names):
+            yield record.event
+
+    def _merged_timezones(self, names: Iterable[str]) -> List[Timezone]:
+        timezones = {}  # type: Dict[TZID, Tuple[Timezone, bool]]
+        for name in names:
+            for tzid, (vtimezone, verified) in self._timezones[name].items():
+                _add_timezone(timezones, tzid, vtimezone, verified)
+        return [vtimezone for vtimezone, _ in timezones.values()]
+
+    def calendar(
+        self,
+        names: Optional[Iterable[str]] = None,
+        *,
+        include: Optional[Callable[[Event], bool]] = None,
+    ) -> Calendar:
+        names = list(self._events if names is None else names)
+        events = self.events(names)
+        if include is not None:
+            events = filter(include, events)
+        return _merged_calendar(self.prodid, self._merged_timezones(names), events)
+
+    def ical(
+        self,
+        names: Optional[Iterable[str]] = None,
+        *,
+        include: Optional[Callable[[Event], bool]] = None,
+    ) -> Iterator[bytes]:
+        # Same as calendar().to_ical(), but streamed. The events are
+        # serialized one at a time and not kept, so only one of them is held
+        # in memory.
+        names = list(self._events if names is None else names)
+        records = self.records(names)  # type: Iterable[EventRecord]
+        if include is not None:
+            records = (r for r in records if include(r.event))
+        return _iter_ical(
+            _merged_calendar(self.prodid, (), ()),
+            chain(
+                (vtimezone.to_ical() for vtimezone in self._merged_timezones(names)),
+                (record.event.to_ical() for record in records),
+            ),
+        )
+
+
+def merge(
+    calendars: Iterable[Calendar],
+    *,
+    prodid: Union[bytes, str] = PRODID,
+    now: Optional[datetime] = None,
+) -> Calendar:
+    merger = IncrementalMerge(prodid=prodid)
+    for i, cal in enumerate(calendars):
+        merger.update(str(i), cal, now=now)
+    return merger.calendar()
+
+
+def merged_events(
+    calendars: Iterable[Calendar],
+    *,
+    now: Optional[datetime] = None,
+) -> Iterator[Event]:
+    merger = IncrementalMerge()
+    for i, cal in enumerate(calendars):
+        merger.update(str(i), cal, now=now)
+    return merger.events()
+
+
 if __name__ == "__main__":
     import argparse
     import sys
@@ -18,24 +18,153 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
 import importlib
-from typing import Any, Dict, Type  # noqa: F401
+from typing import Dict  # noqa: F401
+from typing import List  # noqa: F401
+from typing import (
+    Any,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Sequence,
+    Type,
+    cast,
+)
 
-from icalendar import Calendar  # type: ignore
+from icalendar import Calendar, Event  # type: ignore
+from icalendar.cal import Component  # type: ignore # noqa: F401
 
 from ..config.util import ConfigPath
+from ..ics import memoize_decoded
 
 
 class CalendarProcessor:
     def __init__(self, args: Any, path: ConfigPath):
         raise NotImplementedError
 
-    async def run(self, calendar: Calendar) -> None:
+    # Processors either implement run() or the per-event hooks below. The
+    # latter are driven by run_processors() in a single traversal shared with
+    # the neighbouring processors.
+
+    def start(self, calendar: Calendar) -> None:
+        pass
+
+    # Returns False to drop the event, later processors will not see it.
+    def process_event(self, event: Event) -> bool:
         raise NotImplementedError
 
+    def finish(self, calendar: Calendar) -> None:
+        pass
+
+    async def run(self, calendar: Calendar) -> None:
+        if not _has_event_hook(self):
+            # run_processors() would call run() again
+            raise NotImplementedError
+        await run_processors([self], calendar)
+
+
+def _has_event_hook(processor: CalendarProcessor) -> bool:
+    return type(processor).process_event is not CalendarProcessor.process_event
+
+
+def _run_fused(processors: Sequence[CalendarProcessor], calendar: Calendar) -> None:
+    # Synchronous, so processors can keep state from start() to finish().
+    for processor in processors:
+        processor.start(calendar)
+    kept = []  # type: List[Component]
+    for component in calendar.subcomponents:
+        if component.name == "VEVENT":
+            event = cast(Event, component)
+            if all(processor.process_event(event) for processor in processors):
+                kept.append(event)
+        else:
+            kept.append(component)
+    if len(kept) != len(calendar.subcomponents):
+        calendar.subcomponents[:] = kept
+    for processor in processors:
+        processor.finish(calendar)
+
+
+async def run_processors(
+    processors: Sequence[CalendarProcessor],
+    calendar: Calendar,
+) -> None:
+    # Consecutive processors with per-event hooks are fused into one walk over
+    # the events, the others run on their own.
+    # All of them share the decoded property values.
+    with memoize_decoded():
+        i = 0
+        while i < len(processors):
+            if not _has_event_hook(processors[i]):
+                await processors[i].run(calendar)
+                i += 1
+                continue
+            j = i + 1
+            while j < len(processors) and _has_event_hook(processors[j]):
+                j += 1
+            _run_fused(processors[i:j], calendar)
+            i = j
+
+
+ENTRY_POINT_GROUP = "icsmerge.processors"
+
+
+def _entry_points(name: Optional[str] = None) -> Any:
+    # importlib.metadata scans all installed distributions, so only do it if
+    # a processor is not built in
+    from importlib.metadata import entry_points
+
+    if name is None:
+        return entry_points(group=ENTRY_POINT_GROUP)
+    return entry_points(group=ENTRY_POINT_GROUP, name=name)
+
+
+# Imports a processor only once it is looked up, so dependencies like emoji
+# are only loaded if the config uses them. Names that are not built in are
+# looked up in the icsmerge.processors entry point group.
+class ProcessorRegistry(Mapping[str, Type[CalendarProcessor]]):
+    def __init__(self, names: Iterable[str]):
+        self._names = tuple(names)
+        self._loaded = {}  # type: Dict[str, Type[CalendarProcessor]]
+
+    def __getitem__(self, name: str) -> Type[CalendarProcessor]:
+        try:
+            return self._loaded[name]
+        except KeyError:
+            pass
+        if name in self._names:
+            module = importlib.import_module("." + name, __name__)
+            proc = module.Processor  # type: Type[CalendarProcessor]
+        else:
+            for ep in _entry_points(name):
+                proc = ep.load()
+                break
+            else:
+                raise KeyError(name)
+            if not (isinstance(proc, type) and issubclass(proc, CalendarProcessor)):
+                raise TypeError(
+                    "entry point %r does not refer to a CalendarProcessor" % ep.value
+                )
+        self._loaded[name] = proc
+        return proc
+
+    def __contains__(self, name: object) -> bool:
+        if name in self._names:
+            return True
+        return isinstance(name, str) and bool(_entry_points(name))
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._names
+        for ep in _entry_points():
+            if ep.name not in self._names:
+                yield ep.name
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
 
-all_processors = dict(
-    (name, importlib.import_module("." + name, __name__).Processor)
-    for name in [
+all_processors = ProcessorRegistry(
+    [
         "add_default_property",
         "add_default_timezone",
         "add_default_image_from_nextcloud_attachment",
@@ -43,4 +172,4 @@ all_processors = dict(
         "mod_uid",
         "strip_emoji",
     ]
-)  # type: Dict[str, Type[CalendarProcessor]]
+)
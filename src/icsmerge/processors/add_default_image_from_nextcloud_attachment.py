@@ -22,7 +22,7 @@ from typing import Optional  # noqa: F401
 from typing import Any, Dict
 from urllib.parse import quote, urljoin
 
-from icalendar import Calendar, vText  # type: ignore[import-untyped]
+from icalendar import Event, vText  # type: ignore[import-untyped]
 
 from ..config.util import ConfigPath, str_option_path
 from ..ics import as_str, iter_property_items
@@ -50,36 +50,36 @@ class Processor(CalendarProcessor):
         self.webdav = args["webdav"].rstrip("/") + "/"
         self.remove_prefix = args.get("remove_prefix", "")
 
-    async def run(self, cal: Calendar) -> None:
-        for event in cal.walk("vevent"):
-            if "image" in event:
+    def process_event(self, event: Event) -> bool:
+        if "image" in event:
+            return True
+
+        for comp, name, value in iter_property_items(event, recursive=False):
+            if name.upper() != "ATTACH" or "filename" not in value.params:
                 continue
 
-            for comp, name, value in iter_property_items(event, recursive=False):
-                if name.upper() != "ATTACH" or "filename" not in value.params:
-                    continue
+            # check if filename matches
+            filename = as_str(value.params["filename"])
+            if not filename.startswith(self.remove_prefix):
+                continue
+            filename = filename[len(self.remove_prefix) :]
 
-                # check if filename matches
-                filename = as_str(value.params["filename"])
-                if not filename.startswith(self.remove_prefix):
+            # get MIME type and skip if not an image/*
+            try:
+                fmttype = as_str(value.params["fmttype"])  # type: Optional[str]
+            except KeyError:
+                fmttype = None
+            else:
+                if not fmttype.startswith("image/"):
                     continue
-                filename = filename[len(self.remove_prefix) :]
 
-                # get MIME type and skip if not an image/*
-                try:
-                    fmttype = as_str(value.params["fmttype"])  # type: Optional[str]
-                except KeyError:
-                    fmttype = None
-                else:
-                    if not fmttype.startswith("image/"):
-                        continue
-
-                url = urljoin(
-                    self.webdav,
-                    quote(filename.lstrip("/"), safe="/"),
-                )
-                # add IMAGE:
-                value = vText(url)
-                value.params["VALUE"] = "URI"
-                event["image"] = value
-                logger.debug("added image %s", url)
+            url = urljoin(
+                self.webdav,
+                quote(filename.lstrip("/"), safe="/"),
+            )
+            # add IMAGE:
+            value = vText(url)
+            value.params["VALUE"] = "URI"
+            event["image"] = value
+            logger.debug("added image %s", url)
+        return True
@@ -21,7 +21,7 @@ from typing import Final  # noqa: F401
 from typing import List  # noqa: F401
 from typing import Any, Dict
 
-from icalendar import Calendar  # type: ignore
+from icalendar import Event  # type: ignore
 
 from ..config.util import ConfigPath, str_option_path
 from . import CalendarProcessor
@@ -44,8 +44,8 @@ class Processor(CalendarProcessor):
         if errors:
             raise ValueError("\n".join(errors))
 
-    async def run(self, cal: Calendar) -> None:
-        for event in cal.walk("vevent"):
-            for prop, value in self.properties.items():
-                if prop not in event:
-                    event.add(prop, value)
+    def process_event(self, event: Event) -> bool:
+        for prop, value in self.properties.items():
+            if prop not in event:
+                event.add(prop, value)
+        return True
@@ -17,15 +17,51 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
-from datetime import datetime, timezone
-from typing import Any, Dict, Final, Optional  # noqa: F401
+from datetime import datetime, time, timezone
+from typing import Any, Dict, Final, FrozenSet, List, Optional  # noqa: F401
 
-from icalendar import Calendar, Timezone  # type: ignore
+from icalendar import Calendar, Event, Timezone, vDDDLists  # type: ignore
+from icalendar.cal import Component  # type: ignore
 
 from ..config.util import ConfigPath, str_option_path
-from ..ics import as_str, iter_property_items
+from ..ics import as_str, decoded
 from . import CalendarProcessor
 
+# Properties that can hold DATE-TIME or TIME values, all others are skipped
+# without looking at their values. TRIGGER is usually a DURATION.
+DATE_TIME_PROPERTIES = frozenset(
+    [
+        "ACKNOWLEDGED",
+        "COMPLETED",
+        "CREATED",
+        "DTEND",
+        "DTSTAMP",
+        "DTSTART",
+        "DUE",
+        "EXDATE",
+        "LAST-MODIFIED",
+        "RDATE",
+        "RECURRENCE-ID",
+        "TRIGGER",
+    ]
+)  # type: Final[FrozenSet[str]]
+
+
+def _is_floating(dt: Any) -> bool:
+    if isinstance(dt, tuple):
+        # PERIOD, its end is a DURATION or has the same timezone as its start
+        dt = dt[0]
+    return isinstance(dt, (datetime, time)) and dt.tzinfo is None
+
+
+def _as_utc(dt: Any) -> Any:
+    if isinstance(dt, tuple):
+        return tuple(_as_utc(x) for x in dt)
+    elif isinstance(dt, (datetime, time)) and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    else:
+        return dt
+
 
 class Processor(CalendarProcessor):
     def __init__(self, args: Dict[str, Any], path: ConfigPath):
@@ -50,28 +86,58 @@ class Processor(CalendarProcessor):
             )
         self.default_tz = default_tz  # type: Final[Optional[Timezone]]
         self.default_tzid = default_tzid  # type: Final[Optional[str]]
+        # set while processing a calendar, see start() and finish()
+        self.add_tz = False
+
+    def start(self, cal: Calendar) -> None:
+        self.add_tz = False
+
+    def _process_value(self, value: Any) -> Any:
+        if "tzid" in value.params:
+            return value
+        if isinstance(value, vDDDLists):
+            dts = [x.dt for x in value.dts]  # type: List[Any]
+        else:
+            dts = [getattr(value, "dt", None)]
+        if not any(map(_is_floating, dts)):
+            return value
+        if self.default_tz is None:
+            dts = [_as_utc(dt) for dt in dts]
+        # replace instead of modifying, so memoized decoded values are dropped
+        if isinstance(value, vDDDLists):
+            new_value = type(value)(dts)
+        else:
+            new_value = type(value)(dts[0])
+        new_value.params.update(value.params)
+        if self.default_tz is not None:
+            new_value.params["tzid"] = self.default_tzid
+            self.add_tz = True
+        return new_value
+
+    def _process_component(self, comp: Component) -> None:
+        for name, value in comp.items():
+            if name not in DATE_TIME_PROPERTIES:
+                continue
+            if isinstance(value, list):
+                new_value = [self._process_value(v) for v in value]  # type: Any
+                if any(new is not old for new, old in zip(new_value, value)):
+                    comp[name] = new_value
+            else:
+                new_value = self._process_value(value)
+                if new_value is not value:
+                    comp[name] = new_value
+        for subcomponent in comp.subcomponents:
+            self._process_component(subcomponent)
 
-    async def run(self, cal: Calendar) -> None:
-        add_tz = False
-
-        for event in cal.walk("vevent"):
-            for comp, name, value in iter_property_items(event):
-                dt = comp._decode(name, value)
-                if (
-                    # TODO also handle TIME
-                    isinstance(dt, datetime)
-                    and dt.tzinfo is None
-                    and "tzid" not in value.params
-                ):
-                    if self.default_tz is None:
-                        comp[name] = comp._encode(name, dt.replace(tzinfo=timezone.utc))
-                    else:
-                        value.params["tzid"] = self.default_tzid
-                        add_tz = True
+    def process_event(self, event: Event) -> bool:
+        self._process_component(event)
+        return True
 
+    def finish(self, cal: Calendar) -> None:
+        add_tz = self.add_tz
         if add_tz:
             for tz in cal.walk("vtimezone"):
-                if as_str(tz.decoded("tzid")) == self.default_tzid:
+                if as_str(decoded(tz, "tzid")) == self.default_tzid:
                     # timezone was already defined
                     add_tz = False
                     break
@@ -1,6 +1,6 @@
 """
 icsmerge
-Copyright (C) 2023  schnusch
+Copyright (C) 2023-2026  schnusch
 
 This program is free software; you can redistribute it and/or
 modify it under the terms of the GNU General Public License
@@ -17,21 +17,119 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import logging
 import re
+from datetime import date, datetime, time, timezone
 from typing import List  # noqa: F401
-from typing import Any, Dict, Literal, TypedDict, cast
+from typing import Any, Dict, Iterator, Literal, Optional, TypedDict, Union, cast
 
-from icalendar import Calendar  # type: ignore
+from icalendar import Calendar, Event  # type: ignore
 
 from ..config.util import ConfigPath, str_option_path
-from ..ics import as_str
+from ..ics import as_str, decode_tz_aware, decoded
 from . import CalendarProcessor
 
-ConditionalProperty = Literal["summary"]
+logger = logging.getLogger(__name__)
+
+ConditionalProperty = Literal[
+    "summary",
+    "location",
+    "description",
+    "categories",
+    "dtstart",
+]
+TEXT_PROPERTIES = ("summary", "location", "description", "categories")
 
 
 class Condition(TypedDict, total=False):
-    match: re.Pattern
+    # the regular expressions of a property, combined into as few
+    # alternations as possible
+    match: List[re.Pattern[str]]
+    # dtstart only, events starting in [after, before) are removed
+    after: datetime
+    before: datetime
+
+
+def _as_utc(dt: Union[date, datetime]) -> datetime:
+    # floating times and dates are compared as if they were UTC
+    if not isinstance(dt, datetime):
+        dt = datetime.combine(dt, time.min)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+_GLOBAL_FLAGS_RE = re.compile(r"\(\?([imsx]+)\)(.*)", re.DOTALL)
+
+
+def _as_group(pattern: str) -> str:
+    # leading global flags only apply to this alternative
+    m = _GLOBAL_FLAGS_RE.match(pattern)
+    if m is None:
+        return "(?:%s)" % pattern
+    return "(?%s:%s)" % m.groups()
+
+
+def _combine(patterns: List[re.Pattern[str]]) -> List[re.Pattern[str]]:
+    # Joining patterns renumbers their groups, which changes what numbered
+    # backreferences and conditionals refer to, and duplicate group names
+    # cannot be joined at all. So only patterns without groups are combined.
+    plain = [p for p in patterns if p.groups == 0]
+    combined = [p for p in patterns if p.groups != 0]
+    if len(plain) == 1:
+        combined.insert(0, plain[0])
+    elif plain:
+        try:
+            joined = re.compile("|".join(_as_group(p.pattern) for p in plain))
+        except re.error:
+            # e.g. global flags not supported as scoped flags
+            combined[:0] = plain
+        else:
+            combined.insert(0, joined)
+    return combined
+
+
+def _compile(
+    errors: List[str],
+    patterns: Any,
+    path: ConfigPath,
+) -> Optional[List[re.Pattern[str]]]:
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    elif not isinstance(patterns, list) or not patterns:
+        errors.append(
+            "option %s: must be a string or a list of strings" % str_option_path(*path)
+        )
+        return None
+    compiled = []  # type: List[re.Pattern[str]]
+    for i, pattern in enumerate(patterns):
+        subpath = path if len(patterns) == 1 else (*path, i)
+        if not isinstance(pattern, str):
+            errors.append("option %s: must be a string" % str_option_path(*subpath))
+            continue
+        try:
+            compiled.append(re.compile(pattern))
+        except re.error as e:
+            errors.append(
+                "option %s: is not a valid regular expression: %s"
+                % (str_option_path(*subpath), e)
+            )
+    if len(compiled) != len(patterns):
+        return None
+    return _combine(compiled)
+
+
+def _text_values(event: Event, prop: str) -> Iterator[str]:
+    if prop == "categories":
+        values = event.get(prop, [])
+        for value in values if isinstance(values, list) else [values]:
+            for category in getattr(value, "cats", ()):
+                yield as_str(category)
+    else:
+        try:
+            yield as_str(decoded(event, prop))
+        except KeyError:
+            pass
 
 
 class Processor(CalendarProcessor):
@@ -40,61 +138,78 @@ class Processor(CalendarProcessor):
         errors = []  # type: List[str]
 
         for prop, subargs in args.items():
-            if prop in ("summary",):
-                if isinstance(subargs, dict):
-                    for op, cond in subargs.items():
-                        if op == "match":
-                            if isinstance(cond, str):
-                                try:
-                                    pat = re.compile(cond)
-                                except re.error as e:
-                                    errors.append(
-                                        "option %s: is not a valid regular expression: %s"
-                                        % (str_option_path(*path, prop, op), e)
-                                    )
-                                else:
-                                    self.conditions.setdefault(
-                                        cast(ConditionalProperty, prop),
-                                        {},
-                                    )["match"] = pat
-                            else:
-                                errors.append(
-                                    "option %s: must be a string"
-                                    % str_option_path(*path, prop, op)
-                                )
+            if prop not in TEXT_PROPERTIES and prop != "dtstart":
+                errors.append("unknown option %s" % str_option_path(*path, prop))
+                continue
+            if not isinstance(subargs, dict):
+                errors.append(
+                    "option %s: must be a table" % str_option_path(*path, prop)
+                )
+                continue
+            condition = Condition()
+            for op, cond in subargs.items():
+                if op == "match" and prop in TEXT_PROPERTIES:
+                    pats = _compile(errors, cond, (*path, prop, op))
+                    if pats is not None:
+                        condition["match"] = pats
+                elif op in ("after", "before") and prop == "dtstart":
+                    # TOML dates and date-times
+                    if isinstance(cond, date):
+                        condition[cast(Literal["after", "before"], op)] = _as_utc(cond)
+                    else:
+                        errors.append(
+                            "option %s: must be a date or a date-time"
+                            % str_option_path(*path, prop, op)
+                        )
                 else:
                     errors.append(
-                        "option %s: must be a table" % str_option_path(*path, prop)
+                        "unknown option %s" % str_option_path(*path, prop, op)
                     )
-            else:
-                errors.append("unknown option %s" % str_option_path(*path, prop))
+            if condition:
+                self.conditions[cast(ConditionalProperty, prop)] = condition
 
-        empty = True
-        if errors or self.conditions:
-            empty = False
-        else:
-            for condition in self.conditions.values():
-                if condition:
-                    empty = False
-                    break
-        if empty:
+        if not errors and not self.conditions:
             errors.append("option %s: no conditions given" % str_option_path(*path))
 
         if errors:
             raise ValueError("\n".join(errors))
 
-    async def run(self, cal: Calendar) -> None:
-        remove = []  # type: List[int]
-        for i, event in enumerate(cal.subcomponents):
-            if event.name == "VEVENT":
-                for prop, conditions in self.conditions.items():
-                    try:
-                        value = event.decoded(prop)
-                    except KeyError:
-                        continue
-                    if "match" in conditions and conditions["match"].fullmatch(
-                        as_str(value)
-                    ):
-                        remove.append(i)
-        for i in reversed(remove):
-            cal.subcomponents.pop(i)
+        # events removed by each condition while processing a calendar
+        self.removed = {}  # type: Dict[ConditionalProperty, int]
+
+    def _matches(self, event: Event) -> Optional[ConditionalProperty]:
+        for prop, condition in self.conditions.items():
+            if prop == "dtstart":
+                try:
+                    dtstart = decode_tz_aware(event, prop)
+                except (KeyError, TypeError):
+                    continue
+                if isinstance(dtstart, time):
+                    continue
+                dtstart = _as_utc(dtstart)
+                if "after" in condition and dtstart < condition["after"]:
+                    continue
+                if "before" in condition and dtstart >= condition["before"]:
+                    continue
+                return prop
+            elif "match" in condition:
+                pats = condition["match"]
+                for value in _text_values(event, prop):
+                    if any(pat.fullmatch(value) for pat in pats):
+                        return prop
+        return None
+
+    def start(self, cal: Calendar) -> None:
+        self.removed = dict.fromkeys(self.conditions, 0)
+
+    def process_event(self, event: Event) -> bool:
+        prop = self._matches(event)
+        if prop is None:
+            return True
+        self.removed[prop] = self.removed.get(prop, 0) + 1
+        return False
+
+    def finish(self, cal: Calendar) -> None:
+        for prop, count in self.removed.items():
+            if count:
+                logger.info("filter_out: %s removed %d event(s)", prop, count)
@@ -20,10 +20,10 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 from typing import Final  # noqa: F401
 from typing import Any, Dict
 
-from icalendar import Calendar  # type: ignore
+from icalendar import Event  # type: ignore
 
 from ..config.util import ConfigPath, str_option_path
-from ..ics import as_str
+from ..ics import as_str, decoded
 from . import CalendarProcessor
 
 
@@ -46,11 +46,11 @@ class Processor(CalendarProcessor):
         self.prefix = prefix  # type: Final[str]
         self.suffix = suffix  # type: Final[str]
 
-    async def run(self, cal: Calendar) -> None:
-        for event in cal.walk("vevent"):
-            try:
-                uid = event.decoded("uid")
-            except KeyError:
-                continue
-            uid = self.prefix + as_str(uid) + self.suffix
-            event["uid"] = event._encode("uid", uid)
+    def process_event(self, event: Event) -> bool:
+        try:
+            uid = decoded(event, "uid")
+        except KeyError:
+            return True
+        uid = self.prefix + as_str(uid) + self.suffix
+        event["uid"] = event._encode("uid", uid)
+        return True
@@ -17,39 +17,76 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import re
+from functools import lru_cache
 from typing import Final  # noqa: F401
-from typing import List  # noqa: F401
-from typing import Any, Dict
+from typing import Any, Dict, Iterable, List  # noqa: F401
 
 import emoji
-from icalendar import Calendar  # type: ignore
+from icalendar import Event  # type: ignore
 
 from ..config.util import ConfigPath, str_option_path
-from ..ics import as_str
+from ..ics import as_str, decoded
 from . import CalendarProcessor
 
 
+def _codepoint_class(codepoints: Iterable[int]) -> str:
+    ranges = []  # type: List[List[int]]
+    for cp in sorted(codepoints):
+        if ranges and ranges[-1][1] + 1 == cp:
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    return "[%s]" % "".join(
+        (
+            re.escape(chr(first))
+            if first == last
+            else "%s-%s" % (re.escape(chr(first)), re.escape(chr(last)))
+        )
+        for first, last in ranges
+    )
+
+
+# Every emoji contains at least one of these non-ASCII codepoints, so text
+# without them cannot contain emojis.
+_EMOJI_CODEPOINTS_RE = re.compile(
+    _codepoint_class(
+        set(ord(c) for e in emoji.EMOJI_DATA for c in e if not c.isascii())
+    )
+)
+
+
 class EmojiStripper(object):
     def __init__(self, text: str):
         self.found = []  # type: List[int]
-        self.i = 0
         self.old_text = text
-        self.new_text = emoji.replace_emoji(self.old_text, self.repl)
-        # self.new_text is self.old_text with emojis replaces by a space
         # self.found is the positions of the emojis
-        for j in reversed(self.found):
+        parts = []  # type: List[str]
+        matches = emoji.emoji_list(text)
+        end = 0
+        n = 0
+        while n < len(matches):
+            j = matches[n]["match_start"]
+            k = matches[n]["match_end"]
+            self.found.append(j)
+            n += 1
+            # trailing space
+            while k < len(text) and text[k].isspace():
+                k += 1
+            # emojis only separated by whitespace are replaced as a whole
+            while n < len(matches) and matches[n]["match_start"] == k:
+                self.found.append(k)
+                k = matches[n]["match_end"]
+                n += 1
+                while k < len(text) and text[k].isspace():
+                    k += 1
             # leading space
             i = j
-            while i > 0 and self.old_text[i - 1].isspace():
+            while i > end and text[i - 1].isspace():
                 i -= 1
-            # trailing space
-            k = j + 1
-            while k < len(self.old_text) and self.old_text[k].isspace():
-                k += 1
-            # self.old_text[i:k] is the emoji with surrounding whitespace
-            # self.old_text[j] is the emoji
-            span = self.old_text[i:k]
-            if k - i == 1 or i == 0 or k == len(self.new_text):
+            # text[i:k] is the emojis with surrounding whitespace
+            span = text[i:k]
+            if i == 0 or k == len(text) or not any(c.isspace() for c in span):
                 space = ""
             elif "\n" in span or "\r" in span:
                 space = "\n"
@@ -57,16 +94,18 @@ class EmojiStripper(object):
                 space = "\t"
             else:
                 space = " "
-            self.new_text = self.new_text[:i] + space + self.new_text[k:]
-
-    def repl(self, e: str, data: Dict[str, str]) -> str:
-        self.i = self.old_text.find(e, self.i)
-        self.found.append(self.i)
-        self.i += 1
-        return " "
+            parts.append(text[end:i])
+            parts.append(space)
+            end = k
+        parts.append(text[end:])
+        self.new_text = "".join(parts)
 
 
+@lru_cache(maxsize=4096)
 def strip_emoji(text: str) -> str:
+    # recurring events share their SUMMARY, so results are memoized
+    if text.isascii() or _EMOJI_CODEPOINTS_RE.search(text) is None:
+        return text
     return EmojiStripper(text).new_text
 
 
@@ -97,14 +136,14 @@ class Processor(CalendarProcessor):
                 "option %s: no properties given" % str_option_path(*path, "properties")
             )
 
-    async def run(self, cal: Calendar) -> None:
-        for event in cal.walk("vevent"):
-            for prop in self.properties:
-                try:
-                    old_value = as_str(event.decoded(prop))
-                except KeyError:
-                    continue
-                new_value = strip_emoji(old_value)
-                if new_value != old_value:
-                    del event[prop]
-                    event.add(prop, new_value)
+    def process_event(self, event: Event) -> bool:
+        for prop in self.properties:
+            try:
+                old_value = as_str(decoded(event, prop))
+            except KeyError:
+                continue
+            new_value = strip_emoji(old_value)
+            if new_value != old_value:
+                del event[prop]
+                event.add(prop, new_value)
+        return True
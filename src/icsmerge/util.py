@@ -0,0 +1,46 @@
+"""
+icsmerge
+Copyright (C) 2023-2026  schnusch
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import tempfile
+from typing import Any, BinaryIO, Callable, cast
+
+
+# Atomically replaces the file name with what write() writes to a temporary
+# file next to it, readers only ever see the old or the complete new file. If
+# write() returns False, name is left alone. Returns whether it was replaced.
+def replace_file(name: str, mode: int, write: Callable[[BinaryIO], Any]) -> bool:
+    tmp = tempfile.NamedTemporaryFile(
+        dir=os.path.dirname(name),
+        prefix=".tmp.",
+        suffix=os.path.splitext(name)[1],
+    )
+    try:
+        if write(cast(BinaryIO, tmp)) is False:
+            return False
+        tmp.flush()
+        os.chmod(tmp.fileno(), mode)
+        os.replace(tmp.name, name)
+        return True
+    finally:
+        # if everything is successful it will have been moved
+        try:
+            tmp.close()
+        except FileNotFoundError:
+            pass
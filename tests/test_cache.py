@@ -0,0 +1,205 @@
+"""
+icsmerge
+Copyright (C) 2026  schnusch
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import json
+import os.path
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from icalendar import Calendar, Event  # type: ignore
+
+from icsmerge import (
+    load_processed,
+    prepare_calendar,
+    save_processed,
+    write_output,
+    write_outputs,
+)
+from icsmerge.config import CalendarSource, load_config
+from icsmerge.ics import IncrementalMerge, as_str
+
+NOW = datetime(2026, 10, 17, 12, tzinfo=timezone.utc)
+
+CONFIG = """
+destdir = '{tmpdir}/dest'
+workdir = '{tmpdir}/work'
+
+[calendars.a]
+url = 'http://localhost/a.ics'
+
+[calendars.b]
+url = 'http://localhost/b.ics'
+
+[outputs.'today.json']
+after = '-12h'
+before = '1d'
+fields = ['summary', 'dtend']
+
+[outputs.'b.json']
+before = '4w'
+calendars = ['b']
+
+[outputs.'week.ics']
+after = 0
+before = '1w'
+"""
+
+
+def create_calendar(name: str, *days: int) -> Calendar:
+    cal = Calendar()
+    for day in days:
+        ev = Event()
+        ev.add("summary", "%s%d" % (name, day))
+        ev.add("dtstart", NOW + timedelta(days=day, hours=1))
+        ev.add("duration", timedelta(hours=2))
+        cal.add_component(ev)
+    return cal
+
+
+class ProcessedCacheTest(unittest.TestCase):
+    def test_roundtrip(self) -> None:
+        cal = Calendar()
+        ev = Event()
+        ev.add("summary", "lorem ipsum")
+        cal.add_component(ev)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            name = os.path.join(tmpdir, "processed.pickle")
+            self.assertIsNone(load_processed(name, "body", "processors"))
+            save_processed(name, "body", "processors", cal)
+            cached = load_processed(name, "body", "processors")
+            assert cached is not None
+            self.assertEqual(cached.to_ical(), cal.to_ical())
+            self.assertIsNone(load_processed(name, "other body", "processors"))
+            self.assertIsNone(load_processed(name, "body", "other processors"))
+
+            # pruned calendars only serve cutoffs that are not earlier
+            save_processed(name, "body", "processors", cal, now=NOW)
+            self.assertIsNone(load_processed(name, "body", "processors"))
+            earlier = NOW - timedelta(days=1)
+            self.assertIsNone(load_processed(name, "body", "processors", now=earlier))
+            for now in [NOW, NOW + timedelta(days=1)]:
+                with self.subTest(now=now):
+                    cached = load_processed(name, "body", "processors", now=now)
+                    self.assertIsNotNone(cached)
+
+
+class PrepareCalendarTest(unittest.TestCase):
+    def test_worker(self) -> None:
+        cal = create_calendar("a", 3, -2, 1)
+        berlin = Event()
+        berlin.add("summary", "berlin")
+        berlin.add("dtstart", NOW.astimezone(ZoneInfo("Europe/Berlin")))
+        berlin.add("duration", timedelta(hours=2))
+        cal.add_component(berlin)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            name = os.path.join(tmpdir, "calendar.ics")
+            with open(name, "wb") as fp:
+                fp.write(cal.to_ical())
+            with ProcessPoolExecutor(1) as executor:
+                prepared, records = executor.submit(
+                    prepare_calendar,
+                    CalendarSource(url="http://localhost/a.ics"),
+                    name,
+                    NOW,
+                ).result()
+        assert records is not None
+        self.assertEqual(
+            [as_str(ev.decoded("summary")) for ev in prepared.walk("vevent")],
+            ["berlin", "a1", "a3"],
+        )
+        # the records still refer to the events of the calendar
+        self.assertEqual(
+            [id(r.event) for r in records],
+            [id(ev) for ev in prepared.walk("vevent")],
+        )
+        self.assertEqual(records[0].start, NOW)
+        merger = IncrementalMerge()
+        with self.assertLogs("icsmerge.ics", "WARNING"):
+            # no VTIMEZONE for Europe/Berlin
+            merger.update("a", prepared, records=records)
+        self.assertEqual(list(merger.records()), records)
+
+
+class WriteOutputTest(unittest.TestCase):
+    def test_unchanged(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            name = os.path.join(tmpdir, "calendar.json")
+            self.assertTrue(write_output(tmpdir, "calendar.json", 0o644, b"[]\n"))
+            stat = os.stat(name)
+            self.assertFalse(write_output(tmpdir, "calendar.json", 0o644, b"[]\n"))
+            self.assertEqual(os.stat(name).st_ino, stat.st_ino)
+            self.assertTrue(write_output(tmpdir, "calendar.json", 0o644, b"[{}]\n"))
+            with open(name + ".etag", "rb") as fp:
+                etag = fp.read()
+            self.assertEqual(len(etag), 2 + 64)
+
+    def test_streamed(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.assertTrue(write_output(tmpdir, "calendar.ics", 0o644, b"abc"))
+            self.assertFalse(
+                write_output(tmpdir, "calendar.ics", 0o644, iter([b"a", b"", b"bc"]))
+            )
+            self.assertTrue(
+                write_output(tmpdir, "calendar.ics", 0o644, iter([b"a", b"b"]))
+            )
+            with open(os.path.join(tmpdir, "calendar.ics"), "rb") as fp:
+                self.assertEqual(fp.read(), b"ab")
+            # no temporary files are left behind
+            self.assertEqual(
+                sorted(os.listdir(tmpdir)),
+                ["calendar.ics", "calendar.ics.etag"],
+            )
+
+
+class WriteOutputsTest(unittest.TestCase):
+    def test_outputs(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            name = os.path.join(tmpdir, "config.toml")
+            with open(name, "w") as fp:
+                fp.write(CONFIG.format(tmpdir=tmpdir))
+            config = load_config(name)
+            merger = IncrementalMerge()
+            merger.update("a", create_calendar("a", 0, 3, 10), now=NOW)
+            merger.update("b", create_calendar("b", 0, 20, 40), now=NOW)
+            write_outputs(config, merger, NOW)
+
+            destdir = os.path.join(tmpdir, "dest")
+            self.assertEqual(
+                sorted(x for x in os.listdir(destdir) if not x.endswith(".etag")),
+                ["b.json", "today.json", "week.ics"],
+            )
+            with open(os.path.join(destdir, "today.json"), "rb") as fp:
+                self.assertEqual(
+                    json.load(fp),
+                    [
+                        {"summary": "a0", "dtend": "2026-10-17T15:00:00+00:00"},
+                        {"summary": "b0", "dtend": "2026-10-17T15:00:00+00:00"},
+                    ],
+                )
+            with open(os.path.join(destdir, "b.json"), "rb") as fp:
+                self.assertEqual([x["summary"] for x in json.load(fp)], ["b0", "b20"])
+            with open(os.path.join(destdir, "week.ics"), "rb") as fp:
+                cal = Calendar.from_ical(fp.read())
+            self.assertEqual(
+                [as_str(ev.decoded("summary")) for ev in cal.walk("vevent")],
+                ["a0", "b0", "a3"],
+            )
@@ -0,0 +1,159 @@
+"""
+icsmerge
+Copyright (C) 2026  schnusch
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os.path
+import tempfile
+import unittest
+from datetime import timedelta
+from typing import Any, List  # noqa: F401
+from unittest import mock
+
+import icsmerge.config
+from icsmerge.config import ConfigError, HttpConfig, load_config
+from icsmerge.config.util import parse_duration
+
+CONFIG = """
+destdir = '{tmpdir}/dest'
+workdir = '{tmpdir}/work'
+{extra}
+
+[calendars.a]
+url = 'http://localhost/a.ics'
+processors = [ {{ name = 'mod_uid', args.suffix = '{suffix}' }} ]
+"""
+
+
+class ParseDurationTest(unittest.TestCase):
+    def test_valid(self) -> None:
+        for x, expected in [
+            (0, timedelta()),
+            (90, timedelta(seconds=90)),
+            (1.5, timedelta(seconds=1.5)),
+            ("15m", timedelta(minutes=15)),
+            ("1w 2d", timedelta(weeks=1, days=2)),
+            ("1h30m15s", timedelta(hours=1, minutes=30, seconds=15)),
+            ("0.5d", timedelta(hours=12)),
+            ("+1h", timedelta(hours=1)),
+            ("-12h", timedelta(hours=-12)),
+        ]:
+            with self.subTest(x=x):
+                self.assertEqual(parse_duration(x), expected)
+
+    def test_invalid(self) -> None:
+        invalid = [
+            "",
+            "15",
+            "m",
+            "15x",
+            "1h-30m",
+            "1.h",
+            True,
+            None,
+            [1],
+        ]  # type: List[Any]
+        for x in invalid:
+            with self.subTest(x=x):
+                with self.assertRaises(ValueError):
+                    parse_duration(x)
+
+
+class ConfigTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def load(self, suffix: str = "@a", extra: str = "") -> icsmerge.config.Config:
+        name = os.path.join(self.tmpdir.name, "config.toml")
+        with open(name, "w") as fp:
+            fp.write(CONFIG.format(tmpdir=self.tmpdir.name, suffix=suffix, extra=extra))
+        return load_config(name)
+
+    def fingerprint(self, suffix: str = "@a") -> str:
+        return self.load(suffix).calendars["a"].fingerprint
+
+    def test_fingerprint(self) -> None:
+        fingerprint = self.fingerprint()
+        self.assertEqual(self.fingerprint(), fingerprint)
+        self.assertNotEqual(self.fingerprint("@b"), fingerprint)
+        with mock.patch.object(icsmerge.config, "PROCESSED_CACHE_VERSION", -1):
+            self.assertNotEqual(self.fingerprint(), fingerprint)
+        # changed processor code
+        with mock.patch.object(
+            icsmerge.config,
+            "_module_digest",
+            lambda name: name if name.endswith("mod_uid") else "",
+        ):
+            changed = self.fingerprint()
+        self.assertNotEqual(changed, fingerprint)
+
+    def test_http(self) -> None:
+        self.assertEqual(self.load().http, HttpConfig())
+        self.assertEqual(
+            self.load(
+                extra="[http]\nlimit = 10\nlimit_per_host = 2\ntimeout = 0.5\n"
+            ).http,
+            HttpConfig(limit=10, limit_per_host=2, timeout=0.5),
+        )
+
+    def test_http_invalid(self) -> None:
+        invalid = [
+            ("http = 1", "option 'http': must be a table"),
+            (
+                "[http]\nlimit = -1",
+                "option 'http'.'limit': must be a non-negative integer",
+            ),
+            (
+                "[http]\ndns_cache_ttl = 1.5",
+                "option 'http'.'dns_cache_ttl': must be a non-negative integer",
+            ),
+            (
+                "[http]\nlimit_per_host = true",
+                "option 'http'.'limit_per_host': must be a non-negative integer",
+            ),
+            (
+                "[http]\ntimeout = '5m'",
+                "option 'http'.'timeout': must be a non-negative number of seconds",
+            ),
+            (
+                "[http]\nkeepalive_timeout = -1",
+                "option 'http'.'keepalive_timeout':"
+                " must be a non-negative number of seconds",
+            ),
+            ("[http]\nproxy = ''", "unknown option 'http'.'proxy'"),
+        ]
+        for extra, error in invalid:
+            with self.subTest(extra=extra):
+                with self.assertRaises(ConfigError) as cm:
+                    self.load(extra=extra)
+                self.assertIn(error, str(cm.exception).splitlines())
+
+    def test_interval(self) -> None:
+        config = self.load(extra="interval = '1h'")
+        self.assertEqual(config.interval, timedelta(hours=1))
+        for interval in ["0", "'-1h'", "'soon'"]:
+            with self.subTest(interval=interval):
+                with self.assertRaises(ConfigError):
+                    self.load(extra="interval = %s" % interval)
+
+    def test_prune_before(self) -> None:
+        self.assertEqual(self.load().prune_before, timedelta(hours=-12))
+        config = self.load(extra="[outputs.'past.json']\nafter = '-1w'")
+        self.assertEqual(config.prune_before, timedelta(weeks=-1))
+        config = self.load(extra="[outputs.'soon.json']\nafter = '1h'")
+        self.assertEqual(config.prune_before, timedelta(hours=-12))
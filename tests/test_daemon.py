@@ -0,0 +1,87 @@
+"""
+icsmerge
+Copyright (C) 2026  schnusch
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import asyncio
+import errno
+import tempfile
+import unittest
+from datetime import timedelta
+from typing import Any, Dict, List, Optional  # noqa: F401
+from unittest import mock
+
+from icalendar import Calendar  # type: ignore
+
+from icsmerge import LoadedCalendar, daemon
+from icsmerge.config import CalendarSource, Config
+
+INTERVAL = timedelta(milliseconds=10)
+
+
+class DaemonTest(unittest.IsolatedAsyncioTestCase):
+    async def test_daemon(self) -> None:
+        loads = {"a": 0, "b": 0}  # type: Dict[str, int]
+        writes = []  # type: List[int]
+        written = asyncio.Event()
+
+        async def load_calendar(
+            calsrc: CalendarSource, directory: str, **kwargs: Any
+        ) -> LoadedCalendar:
+            name = calsrc.url
+            loads[name] += 1
+            previous = kwargs.get("previous")  # type: Optional[LoadedCalendar]
+            # b changes on every refresh, a never does
+            if previous is not None and name == "a":
+                return previous
+            return LoadedCalendar(str(loads[name]), Calendar())
+
+        def write_outputs(config: Config, merger: Any) -> None:
+            writes.append(len(writes))
+            if len(writes) == 2:
+                raise OSError(errno.ENOSPC, "No space left on device")
+            if len(writes) >= 5:
+                written.set()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config = Config(
+                destdir=tmpdir,
+                workdir=tmpdir,
+                destmode=0o644,
+                maxsize=0,
+                calendars={
+                    # a is only refreshed every remerge interval
+                    "a": CalendarSource(url="a", interval=INTERVAL * 5),
+                    "b": CalendarSource(url="b", interval=INTERVAL),
+                },
+                interval=INTERVAL * 5,
+            )
+            with (
+                mock.patch("icsmerge.load_calendar", load_calendar),
+                mock.patch("icsmerge.write_outputs", write_outputs),
+            ):
+                task = asyncio.create_task(daemon(config))
+                # a failed write does not stop the daemon
+                await asyncio.wait_for(written.wait(), 5)
+                self.assertFalse(task.done())
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+
+        # every source is refreshed on its own interval
+        self.assertGreater(loads["b"], loads["a"])
+        self.assertGreaterEqual(loads["a"], 1)
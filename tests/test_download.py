@@ -0,0 +1,128 @@
+"""
+icsmerge
+Copyright (C) 2026  schnusch
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import asyncio
+import hashlib
+import os.path
+import tempfile
+import unittest
+from typing import BinaryIO, List  # noqa: F401
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from icalendar import Calendar  # type: ignore
+
+from icsmerge.download import download_calendar, download_ics
+
+ICS = b"\r\n".join(
+    [
+        b"BEGIN:VCALENDAR",
+        b"PRODID:-//icsmerge//test",
+        b"VERSION:2.0",
+        b"BEGIN:VEVENT",
+        b"UID:1@test",
+        b"DTSTAMP:20260101T000000Z",
+        b"DTSTART:20260101T120000Z",
+        b"SUMMARY:lorem ipsum",
+        b"END:VEVENT",
+        b"END:VCALENDAR",
+        b"",
+    ]
+)
+ETAG = '"v1"'
+
+
+class DownloadTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.requests = []  # type: List[web.Request]
+        self.body = ICS
+        self.hang = False
+
+        async def handler(request: web.Request) -> web.Response:
+            self.requests.append(request)
+            if self.hang:
+                await asyncio.Event().wait()
+            if request.headers.get("If-None-Match") == ETAG:
+                return web.Response(status=304)
+            return web.Response(body=self.body, headers={"ETag": ETAG})
+
+        app = web.Application()
+        app.router.add_get("/calendar.ics", handler)
+        self.server = TestServer(app)
+        await self.server.start_server()
+        self.url = str(self.server.make_url("/calendar.ics"))
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+        self.tmpdir.cleanup()
+
+    async def test_not_modified(self) -> None:
+        with await download_ics(self.url, self.tmpdir.name) as fp:
+            self.assertEqual(fp.read(), ICS)
+        self.assertNotIn("If-None-Match", self.requests[0].headers)
+
+        self.body = b"must not be downloaded"
+        with await download_ics(self.url, self.tmpdir.name) as fp:
+            self.assertEqual(fp.read(), ICS)
+        self.assertEqual(self.requests[1].headers.get("If-None-Match"), ETAG)
+
+    async def test_invalid_download_keeps_local_copy(self) -> None:
+        with await download_ics(self.url, self.tmpdir.name) as fp:
+            self.assertEqual(fp.read(), ICS)
+
+        self.requests.clear()
+        self.body = b"not an iCalendar file"
+        # force a full download
+        os.unlink(os.path.join(self.tmpdir.name, "calendar.ics.validators"))
+        with await download_ics(self.url, self.tmpdir.name) as fp:
+            self.assertEqual(fp.read(), ICS)
+        self.assertEqual(len(self.requests), 1)
+
+    async def test_parse_once(self) -> None:
+        parsed = []  # type: List[bytes]
+
+        async def parse(fp: BinaryIO, digest: str) -> Calendar:
+            self.assertEqual(digest, hashlib.sha256(ICS).hexdigest())
+            data = fp.read()
+            parsed.append(data)
+            return Calendar.from_ical(data)
+
+        cal = await download_calendar(self.url, self.tmpdir.name, parse)
+        self.assertEqual(parsed, [ICS])
+        self.assertEqual(len(cal.walk("vevent")), 1)
+
+    async def test_maxsize(self) -> None:
+        with self.assertRaises(FileNotFoundError):
+            await download_ics(self.url, self.tmpdir.name, maxsize=len(ICS) // 2)
+        with await download_ics(self.url, self.tmpdir.name, maxsize=0) as fp:
+            self.assertEqual(fp.read(), ICS)
+
+    async def test_cancelled(self) -> None:
+        with await download_ics(self.url, self.tmpdir.name) as fp:
+            self.assertEqual(fp.read(), ICS)
+
+        # cancelling a refresh must not fall back to the local copy
+        self.hang = True
+        task = asyncio.create_task(download_ics(self.url, self.tmpdir.name))
+        while len(self.requests) < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
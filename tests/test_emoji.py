@@ -17,13 +17,18 @@ along with this program; if not, write to the Free Software
 Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 """
 
+import os
+import time
 import unittest
 from typing import ClassVar, Tuple
 
+import emoji
 from icalendar import Calendar, Event  # type: ignore
 
 from icsmerge.ics import as_str
-from icsmerge.processors.strip_emoji import Processor
+from icsmerge.processors.strip_emoji import Processor, strip_emoji
+
+BENCHMARK = bool(os.environ.get("ICSMERGE_BENCHMARK"))
 
 
 def create_calendar(summary: str) -> Tuple[Calendar, Event]:
@@ -80,3 +85,53 @@ class EmojiTest(unittest.IsolatedAsyncioTestCase):
         cal, ev = create_calendar("lorem  ipsum  \U0001F43B")
         await self.proc.run(cal)
         self.assertEqual(as_str(ev.decoded("summary")), "lorem  ipsum")
+
+    def test_no_emoji(self) -> None:
+        for text in ["lorem ipsum", "Büchertauschbörse", "Café 20 €", ""]:
+            with self.subTest(text=text):
+                self.assertIs(strip_emoji(text), text)
+
+    def test_emoji_sequences(self) -> None:
+        family = "\U0001F468\u200D\U0001F469\u200D\U0001F467"
+        flag = "\U0001F1E9\U0001F1EA"
+        self.assertEqual(strip_emoji("lorem %s ipsum" % family), "lorem ipsum")
+        self.assertEqual(strip_emoji("lorem%sipsum" % flag), "loremipsum")
+        self.assertEqual(
+            strip_emoji("%s lorem ipsum %s" % (flag, family)), "lorem ipsum"
+        )
+
+    def test_emoji_run(self) -> None:
+        bear = "\U0001F43B"
+        self.assertEqual(strip_emoji("lorem %s %s ipsum" % (bear, bear)), "lorem ipsum")
+        self.assertEqual(
+            strip_emoji("lorem %s\n%s ipsum" % (bear, bear)), "lorem\nipsum"
+        )
+        self.assertEqual(
+            strip_emoji("lorem %s ipsum %s dolor" % (bear, bear)), "lorem ipsum dolor"
+        )
+
+    @unittest.skipUnless(BENCHMARK, "set ICSMERGE_BENCHMARK=1 to run benchmarks")
+    def test_benchmark(self) -> None:
+        # mostly plain summaries, repeated like those of recurring events
+        summaries = [
+            "Barabend",
+            "Spieleabend mit Freunden",
+            "K\u00FCchenparty \U0001F389",
+            "\U0001F43B Live: lorem ipsum \U0001F3B8\U0001F3B8",
+            "Open Air \u2600\uFE0F",
+        ] * 2000
+
+        t0 = time.perf_counter()
+        for text in summaries:
+            emoji.replace_emoji(text, " ")
+        t1 = time.perf_counter()
+        strip_emoji.cache_clear()
+        for text in summaries:
+            strip_emoji(text)
+        t2 = time.perf_counter()
+
+        print(
+            "\nstrip_emoji on %d summaries: replace_emoji %.3fs, strip_emoji %.3fs"
+            % (len(summaries), t1 - t0, t2 - t1)
+        )
+        self.assertLess(t2 - t1, t1 - t0)
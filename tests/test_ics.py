@@ -0,0 +1,232 @@
+"""
+icsmerge
+Copyright (C) 2026  schnusch
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os
+import time
+import unittest
+from datetime import date, datetime, timedelta, timezone
+from typing import List  # noqa: F401
+from typing import Union
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+from dateutil.rrule import rrulestr  # type: ignore
+from icalendar import Calendar, Event, vRecur  # type: ignore
+
+import icsmerge.ics
+from icsmerge.ics import (
+    EventRecord,
+    OccurrenceIndex,
+    as_str,
+    event_has_passed,
+    get_rrule,
+    list_of_dict_events,
+)
+
+NOW = datetime(2026, 10, 17, 12, tzinfo=timezone.utc)
+BENCHMARK = bool(os.environ.get("ICSMERGE_BENCHMARK"))
+
+
+def create_event(dtstart: Union[date, datetime], rrule: str) -> Event:
+    ev = Event()
+    ev.add("dtstart", dtstart)
+    ev.add("duration", timedelta(hours=2))
+    ev.add("rrule", vRecur.from_ical(rrule))
+    return ev
+
+
+def iterate_has_passed(event: Event, now: datetime) -> bool:
+    # what event_has_passed did before it learned about UNTIL and COUNT
+    dtstart = event.decoded("dtstart")
+    rrule = rrulestr(as_str(event["rrule"].to_ical()), dtstart=dtstart)
+    return rrule.after(now - event.decoded("duration"), inc=True) is None
+
+
+class RRuleTest(unittest.TestCase):
+    def test_cached(self) -> None:
+        utc = datetime(2026, 1, 5, 18, tzinfo=timezone.utc)
+        berlin = utc.astimezone(ZoneInfo("Europe/Berlin"))
+        weekly = vRecur.from_ical("FREQ=WEEKLY")
+        self.assertIs(get_rrule(weekly, utc), get_rrule(vRecur(weekly), utc))
+        # same instant, but the occurrences follow a different local time
+        self.assertIsNot(get_rrule(weekly, utc), get_rrule(weekly, berlin))
+        self.assertNotEqual(
+            get_rrule(weekly, utc)[30],
+            get_rrule(weekly, berlin)[30],
+        )
+
+
+class OccurrenceTest(unittest.TestCase):
+    def test_rdate_exdate_recurrence_id(self) -> None:
+        start = datetime(2026, 10, 5, 18, tzinfo=timezone.utc)
+        master = create_event(start, "FREQ=WEEKLY;COUNT=4")
+        master.add("uid", "weekly@test")
+        master.add("summary", "weekly")
+        master.add("exdate", start + timedelta(weeks=2))
+        master.add("rdate", datetime(2026, 10, 22, 9, tzinfo=timezone.utc))
+        moved = Event()
+        moved.add("uid", "weekly@test")
+        moved.add("summary", "moved")
+        moved.add("recurrence-id", start + timedelta(weeks=1))
+        moved.add("dtstart", datetime(2026, 10, 13, 9, tzinfo=timezone.utc))
+        cancelled = Event()
+        cancelled.add("uid", "weekly@test")
+        cancelled.add("summary", "cancelled")
+        cancelled.add("recurrence-id", start + timedelta(weeks=3))
+        cancelled.add("dtstart", start + timedelta(weeks=3))
+        cancelled.add("status", "CANCELLED")
+        cal = Calendar()
+        for ev in [master, moved, cancelled]:
+            cal.add_component(ev)
+
+        events = list_of_dict_events(
+            cal, after=start, before=start + timedelta(weeks=5)
+        )
+        self.assertEqual(
+            [(ev["summary"], ev["dtstart"]) for ev in events],
+            [
+                ("weekly", "2026-10-05T18:00:00+00:00"),
+                ("moved", "2026-10-13T09:00:00+00:00"),
+                ("weekly", "2026-10-22T09:00:00+00:00"),
+            ],
+        )
+
+    def test_windows(self) -> None:
+        cal = Calendar()
+        cal.add_component(create_event(NOW - timedelta(weeks=3), "FREQ=DAILY"))
+        cal.add_component(create_event(date(2020, 10, 18), "FREQ=YEARLY"))
+        cal.add_component(create_event(NOW.replace(tzinfo=None), "FREQ=WEEKLY"))
+        for i in range(10):
+            single = Event()
+            single.add("dtstart", NOW + timedelta(days=3 * i, hours=i))
+            cal.add_component(single)
+
+        index = OccurrenceIndex(cal)
+        starts = [x.start for x in index.between(NOW, NOW + timedelta(days=1))]
+        self.assertIn(date(2026, 10, 18), starts)
+        for after, before in [
+            (NOW, NOW + timedelta(weeks=4)),
+            (NOW, NOW + timedelta(days=1)),
+            (NOW - timedelta(weeks=2), NOW),
+            (NOW + timedelta(weeks=8), NOW + timedelta(weeks=9)),
+            (NOW - timedelta(weeks=1), NOW + timedelta(weeks=10)),
+        ]:
+            with self.subTest(after=after, before=before):
+                # a reused index must answer like a freshly built one
+                expected = OccurrenceIndex(cal).between(after, before)
+                actual = index.between(after, before)
+                self.assertEqual(actual, expected)
+                self.assertTrue(actual)
+                self.assertEqual(actual[0].start, after)
+
+
+class EventRecordTest(unittest.TestCase):
+    def test_decoded(self) -> None:
+        berlin = ZoneInfo("Europe/Berlin")
+        event = create_event(datetime(2026, 10, 5, 18, tzinfo=berlin), "FREQ=DAILY")
+        event.add("uid", "daily@test")
+        event.add("summary", "daily")
+        event.add("rrule", vRecur.from_ical("FREQ=WEEKLY;COUNT=3"))
+        record = EventRecord(event)
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertEqual(record.key, datetime(2026, 10, 5, 16, tzinfo=timezone.utc))
+        self.assertEqual(record.end, datetime(2026, 10, 5, 20, tzinfo=berlin))
+        self.assertEqual(record.rrule, ("FREQ=DAILY", "FREQ=WEEKLY;COUNT=3"))
+        self.assertEqual((record.uid, record.summary), ("daily@test", "daily"))
+        self.assertIsNone(record.location)
+        # the open-ended RRULE keeps the series alive
+        self.assertFalse(record.has_passed(NOW))
+
+        all_day = Event()
+        all_day.add("dtstart", date(2026, 10, 5))
+        self.assertEqual(
+            EventRecord(all_day).key, datetime(2026, 10, 5, tzinfo=timezone.utc)
+        )
+        self.assertIsNone(EventRecord(Event()).key)
+
+    def test_lazy_texts(self) -> None:
+        event = Event()
+        event.add("dtstart", datetime(2026, 10, 5, 18, tzinfo=timezone.utc))
+        event.add("summary", "summary")
+        event.add("description", "lorem ipsum " * 1000)
+        with mock.patch(
+            "icsmerge.ics._decoded_str", wraps=icsmerge.ics._decoded_str
+        ) as decoded_str:
+            record = EventRecord(event)
+            decoded = [call.args[1] for call in decoded_str.call_args_list]
+            self.assertNotIn("summary", decoded)
+            self.assertNotIn("description", decoded)
+            decoded_str.reset_mock()
+            self.assertEqual(record.summary, "summary")
+            self.assertEqual(record.summary, "summary")
+            self.assertIsNone(record.url)
+            self.assertEqual(
+                [call.args[1] for call in decoded_str.call_args_list],
+                ["summary", "url"],
+            )
+
+
+class EventHasPassedTest(unittest.TestCase):
+    def test_rrule(self) -> None:
+        start = datetime(2020, 1, 6, 19, tzinfo=ZoneInfo("Europe/Berlin"))
+        for rrule, passed in [
+            ("FREQ=WEEKLY", False),
+            ("FREQ=WEEKLY;UNTIL=20250101T000000Z", True),
+            ("FREQ=WEEKLY;UNTIL=20270101T000000Z", False),
+            ("FREQ=WEEKLY;UNTIL=20261012T180000Z", True),
+            ("FREQ=WEEKLY;UNTIL=20261019T180000Z", False),
+            ("FREQ=WEEKLY;COUNT=10", True),
+            ("FREQ=WEEKLY;COUNT=1000", False),
+        ]:
+            with self.subTest(rrule=rrule):
+                event = create_event(start, rrule)
+                self.assertEqual(event_has_passed(event, NOW), passed)
+                self.assertEqual(iterate_has_passed(event, NOW), passed)
+
+    def test_rrule_all_day(self) -> None:
+        for rrule, passed in [
+            ("FREQ=YEARLY", False),
+            ("FREQ=YEARLY;UNTIL=20250101", True),
+            ("FREQ=YEARLY;COUNT=3", True),
+            ("FREQ=YEARLY;COUNT=30", False),
+        ]:
+            with self.subTest(rrule=rrule):
+                event = create_event(date(2020, 1, 1), rrule)
+                self.assertEqual(event_has_passed(event, NOW), passed)
+
+    @unittest.skipUnless(BENCHMARK, "set ICSMERGE_BENCHMARK=1 to run benchmarks")
+    def test_benchmark(self) -> None:
+        events = []  # type: List[Event]
+        for i in range(1000):
+            start = datetime(2015, 1, 1, 18, tzinfo=timezone.utc) + timedelta(hours=i)
+            events.append(create_event(start, "FREQ=WEEKLY"))
+            events.append(create_event(start, "FREQ=DAILY;UNTIL=20200101T000000Z"))
+
+        t0 = time.perf_counter()
+        expected = [iterate_has_passed(ev, NOW) for ev in events]
+        t1 = time.perf_counter()
+        actual = [event_has_passed(ev, NOW) for ev in events]
+        t2 = time.perf_counter()
+
+        self.assertEqual(actual, expected)
+        print(
+            "\nevent_has_passed on %d series: iterating %.3fs, UNTIL/COUNT %.3fs"
+            % (len(events), t1 - t0, t2 - t1)
+        )
+        self.assertLess(t2 - t1, t1 - t0)
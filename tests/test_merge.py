@@ -0,0 +1,312 @@
+"""
+icsmerge
+Copyright (C) 2026  schnusch
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os.path
+import stat
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta, timezone
+from typing import List, cast
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+from icalendar import Calendar, Event, Timezone  # type: ignore
+
+from icsmerge.ics import (
+    TZID,
+    IncrementalMerge,
+    TimezoneRegistry,
+    as_str,
+    iter_ical,
+    merge,
+    merged_events,
+    prune_and_sort_records,
+    tzdata_version,
+)
+
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+BERLIN = b"""\
+BEGIN:VTIMEZONE\r
+TZID:Europe/Berlin\r
+BEGIN:DAYLIGHT\r
+TZOFFSETFROM:+0100\r
+TZOFFSETTO:+0200\r
+TZNAME:CEST\r
+DTSTART:19700329T020000\r
+RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU\r
+END:DAYLIGHT\r
+BEGIN:STANDARD\r
+TZOFFSETFROM:+0200\r
+TZOFFSETTO:+0100\r
+TZNAME:CET\r
+DTSTART:19701025T030000\r
+RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU\r
+END:STANDARD\r
+END:VTIMEZONE\r
+"""
+# US daylight saving time
+WRONG_BERLIN = BERLIN.replace(b"BYMONTH=3;BYDAY=-1SU", b"BYMONTH=3;BYDAY=2SU").replace(
+    b"BYMONTH=10;BYDAY=-1SU", b"BYMONTH=11;BYDAY=1SU"
+)
+
+
+def create_calendar(*days: int) -> Calendar:
+    cal = Calendar()
+    for day in days:
+        ev = Event()
+        ev.add("summary", str(day))
+        ev.add("dtstart", NOW + timedelta(days=day))
+        ev.add("duration", timedelta(hours=1))
+        cal.add_component(ev)
+    return cal
+
+
+def summaries(cal: Calendar) -> List[str]:
+    return [as_str(ev.decoded("summary")) for ev in cal.walk("vevent")]
+
+
+class MergeTest(unittest.TestCase):
+    def test_chronological(self) -> None:
+        cals = [create_calendar(5, 1, 3), create_calendar(4, 2)]
+        self.assertEqual(summaries(merge(cals, now=NOW)), ["1", "2", "3", "4", "5"])
+        self.assertEqual(
+            [as_str(ev.decoded("summary")) for ev in merged_events(cals, now=NOW)],
+            ["1", "2", "3", "4", "5"],
+        )
+
+    def test_mixed_starts(self) -> None:
+        # all-day and floating starts are ordered as if they were UTC
+        starts = {
+            "allday-dec": date(2026, 12, 1),
+            "floating-jun": datetime(2026, 6, 1, 12),
+            "aware-jan2": datetime(2026, 1, 2, 12, tzinfo=timezone.utc),
+            "berlin-jun": datetime(
+                2026, 6, 1, 13, 30, tzinfo=ZoneInfo("Europe/Berlin")
+            ),
+            "allday-jun": date(2026, 6, 1),
+        }
+        cals = []
+        for summary, dtstart in starts.items():
+            cal = Calendar()
+            ev = Event()
+            ev.add("summary", summary)
+            ev.add("dtstart", dtstart)
+            cal.add_component(ev)
+            cals.append(cal)
+        expected = [
+            "aware-jan2",
+            "allday-jun",
+            "berlin-jun",
+            "floating-jun",
+            "allday-dec",
+        ]
+        self.assertEqual(summaries(merge(cals, now=NOW)), expected)
+        merger = IncrementalMerge()
+        for i, cal in enumerate(cals):
+            merger.update(str(i), cal, now=NOW)
+        self.assertEqual(summaries(merger.calendar()), expected)
+
+
+class IncrementalMergeTest(unittest.TestCase):
+    def test_update(self) -> None:
+        merger = IncrementalMerge()
+        merger.update("a", create_calendar(5, 1, 3), now=NOW)
+        merger.update("b", create_calendar(-1, 4, 2), now=NOW)
+        self.assertEqual(summaries(merger.calendar()), ["1", "2", "3", "4", "5"])
+
+        merger.update("a", create_calendar(6), now=NOW)
+        self.assertEqual(summaries(merger.calendar()), ["2", "4", "6"])
+
+        merger.remove("b")
+        self.assertEqual(summaries(merger.calendar()), ["6"])
+
+    def test_ical(self) -> None:
+        merger = IncrementalMerge(timezones=TimezoneRegistry(now=NOW))
+        merger.update("a", create_calendar(5, 1, 3), now=NOW)
+        merger.update("b", create_berlin_calendar(BERLIN, 2), now=NOW)
+        for names in [None, ["a"], ["b"]]:
+            with self.subTest(names=names):
+                cal = merger.calendar(names)
+                self.assertEqual(b"".join(iter_ical(cal)), cal.to_ical())
+                self.assertEqual(b"".join(merger.ical(names)), cal.to_ical())
+        cal = merger.calendar(include=lambda ev: "summary" in ev)
+        self.assertEqual(
+            b"".join(merger.ical(include=lambda ev: "summary" in ev)),
+            cal.to_ical(),
+        )
+
+    def test_records(self) -> None:
+        cal = create_calendar(5, -1, 1, 3)
+        records = prune_and_sort_records(cal, NOW)
+        self.assertEqual(summaries(cal), ["1", "3", "5"])
+        merger = IncrementalMerge()
+        # the records are taken as they are, the events are not decoded again
+        with mock.patch("icsmerge.ics.EventRecord") as record:
+            merger.update("a", cal, now=NOW, records=records)
+        record.assert_not_called()
+        self.assertEqual([id(r) for r in merger.records()], [id(r) for r in records])
+
+    def test_prune(self) -> None:
+        merger = IncrementalMerge()
+        merger.update("a", create_calendar(1, 3), now=NOW)
+        merger.prune(NOW + timedelta(days=2))
+        self.assertEqual(summaries(merger.calendar()), ["3"])
+
+    def test_prune_timezones(self) -> None:
+        merger = IncrementalMerge(timezones=TimezoneRegistry(now=NOW))
+        cal = create_berlin_calendar(BERLIN, 1)
+        for ev in create_calendar(3).walk("vevent"):
+            cal.add_component(ev)
+        merger.update("a", cal, now=NOW)
+        self.assertEqual(len(merger.calendar().walk("vtimezone")), 1)
+        merger.prune(NOW + timedelta(days=2))
+        merged = merger.calendar()
+        self.assertEqual(summaries(merged), ["3"])
+        self.assertEqual(merged.walk("vtimezone"), [])
+
+    def test_prune_overrides(self) -> None:
+        cal = Calendar()
+        master = Event()
+        master.add("uid", "weekly@test")
+        master.add("summary", "master")
+        master.add("dtstart", datetime(2026, 1, 5, 12, tzinfo=timezone.utc))
+        master.add("duration", timedelta(hours=1))
+        master.add("rrule", {"freq": "weekly"})
+        cal.add_component(master)
+        # moves the occurrence of Jan 19 to Jan 10
+        moved = Event()
+        moved.add("uid", "weekly@test")
+        moved.add("summary", "moved")
+        moved.add("recurrence-id", datetime(2026, 1, 19, 12, tzinfo=timezone.utc))
+        moved.add("dtstart", datetime(2026, 1, 10, 12, tzinfo=timezone.utc))
+        moved.add("duration", timedelta(hours=1))
+        cal.add_component(moved)
+        # passed and not overriding anything that is still around
+        orphan = Event()
+        orphan.add("uid", "other@test")
+        orphan.add("summary", "orphan")
+        orphan.add("recurrence-id", datetime(2026, 1, 12, 12, tzinfo=timezone.utc))
+        orphan.add("dtstart", datetime(2026, 1, 12, 12, tzinfo=timezone.utc))
+        orphan.add("duration", timedelta(hours=1))
+        cal.add_component(orphan)
+
+        now = datetime(2026, 1, 15, tzinfo=timezone.utc)
+        merger = IncrementalMerge()
+        merger.update("a", cal, now=now)
+        self.assertEqual(summaries(merger.calendar()), ["master", "moved"])
+
+        merger = IncrementalMerge()
+        merger.update("a", cal, now=NOW)
+        merger.prune(now)
+        self.assertEqual(summaries(merger.calendar()), ["master", "moved"])
+
+
+def create_berlin_calendar(vtimezone: bytes, day: int) -> Calendar:
+    cal = Calendar()
+    cal.add_component(Timezone.from_ical(vtimezone))
+    ev = Event()
+    ev.add("summary", str(day))
+    ev.add("dtstart", (NOW + timedelta(days=day)).astimezone(ZoneInfo("Europe/Berlin")))
+    ev.add("duration", timedelta(hours=1))
+    cal.add_component(ev)
+    return cal
+
+
+def parse_timezone(vtimezone: bytes) -> Timezone:
+    return cast(Timezone, Timezone.from_ical(vtimezone))
+
+
+class TimezoneRegistryTest(unittest.TestCase):
+    def test_verify(self) -> None:
+        registry = TimezoneRegistry(now=NOW)
+        berlin = TZID("Europe/Berlin")
+        self.assertTrue(registry.verify(berlin, parse_timezone(BERLIN)))
+        with self.assertLogs("icsmerge.ics", "WARNING"):
+            self.assertFalse(registry.verify(berlin, parse_timezone(WRONG_BERLIN)))
+        with self.assertLogs("icsmerge.ics", "WARNING"):
+            self.assertFalse(
+                registry.verify(TZID("Mars/Olympus_Mons"), parse_timezone(BERLIN))
+            )
+
+    def test_deduplicate(self) -> None:
+        merger = IncrementalMerge(timezones=TimezoneRegistry(now=NOW))
+        with self.assertLogs("icsmerge.ics", "WARNING"):
+            merger.update("a", create_berlin_calendar(WRONG_BERLIN, 1), now=NOW)
+        merger.update("b", create_berlin_calendar(BERLIN, 2), now=NOW)
+        merged = merger.calendar()
+        self.assertEqual(summaries(merged), ["1", "2"])
+        # the definition matching the system's zoneinfo wins
+        self.assertEqual(
+            [tz.to_ical() for tz in merged.walk("vtimezone")],
+            [Timezone.from_ical(BERLIN).to_ical()],
+        )
+
+    def test_cached(self) -> None:
+        berlin = TZID("Europe/Berlin")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "timezones.json")
+            registry = TimezoneRegistry(path, now=NOW)
+            with self.assertLogs("icsmerge.ics", "WARNING"):
+                registry.verify(berlin, parse_timezone(WRONG_BERLIN))
+            registry.verify(berlin, parse_timezone(BERLIN))
+            registry.save()
+            self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o600)
+            self.assertEqual(os.listdir(tmpdir), ["timezones.json"])
+
+            registry = TimezoneRegistry(path, now=NOW)
+            with mock.patch.object(registry, "_matches_zoneinfo") as matches:
+                self.assertTrue(registry.verify(berlin, parse_timezone(BERLIN)))
+                self.assertFalse(registry.verify(berlin, parse_timezone(WRONG_BERLIN)))
+            matches.assert_not_called()
+
+    def test_expired(self) -> None:
+        berlin = TZID("Europe/Berlin")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "timezones.json")
+            registry = TimezoneRegistry(path, now=NOW)
+            registry.verify(berlin, parse_timezone(BERLIN))
+            registry.save()
+
+            for now, version in [
+                (NOW.replace(year=NOW.year + 1), tzdata_version()),
+                (NOW, "0000a"),
+            ]:
+                with (
+                    self.subTest(now=now, version=version),
+                    mock.patch("icsmerge.ics.tzdata_version", return_value=version),
+                ):
+                    registry = TimezoneRegistry(path, now=now)
+                    with mock.patch.object(
+                        registry, "_matches_zoneinfo", return_value=True
+                    ) as matches:
+                        registry.verify(berlin, parse_timezone(BERLIN))
+                    matches.assert_called_once()
+
+    def test_new_year(self) -> None:
+        berlin = TZID("Europe/Berlin")
+        registry = TimezoneRegistry(now=NOW)
+        registry.verify(berlin, parse_timezone(BERLIN))
+        registry._now = NOW.replace(year=NOW.year + 1)
+        with mock.patch.object(
+            registry, "_matches_zoneinfo", return_value=True
+        ) as matches:
+            registry.verify(berlin, parse_timezone(BERLIN))
+            registry.verify(berlin, parse_timezone(BERLIN))
+        matches.assert_called_once()
@@ -0,0 +1,373 @@
+"""
+icsmerge
+Copyright (C) 2026  schnusch
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import os.path
+import sys
+import tempfile
+import time
+import unittest
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List  # noqa: F401
+from unittest import mock
+
+from icalendar import Calendar, Event  # type: ignore
+from icalendar.cal import Component  # type: ignore
+
+from icsmerge.config.util import ConfigPath
+from icsmerge.ics import as_str, iter_property_items
+from icsmerge.processors import CalendarProcessor, all_processors, run_processors
+from icsmerge.processors.add_default_timezone import Processor as AddDefaultTimezone
+from icsmerge.processors.filter_out import Processor as FilterOut
+from icsmerge.processors.mod_uid import Processor as ModUid
+from icsmerge.processors.strip_emoji import Processor as StripEmoji
+
+BENCHMARK = bool(os.environ.get("ICSMERGE_BENCHMARK"))
+
+
+class Recorder(CalendarProcessor):
+    def __init__(self, args: Any, path: ConfigPath):
+        self.seen = []  # type: List[str]
+
+    def process_event(self, event: Event) -> bool:
+        self.seen.append(as_str(event.decoded("summary")))
+        return True
+
+
+class Walker(CalendarProcessor):
+    # only implements run(), so it cannot be fused with its neighbours
+    def __init__(self, args: Any, path: ConfigPath):
+        self.seen = []  # type: List[str]
+
+    async def run(self, calendar: Calendar) -> None:
+        for event in calendar.walk("vevent"):
+            self.seen.append(as_str(event.decoded("uid")))
+
+
+def create_calendar(*summaries: str) -> Calendar:
+    cal = Calendar()
+    for summary in summaries:
+        ev = Event()
+        ev.add("summary", summary)
+        ev.add("uid", summary)
+        cal.add_component(ev)
+    return cal
+
+
+class PipelineTest(unittest.IsolatedAsyncioTestCase):
+    async def test_fused(self) -> None:
+        before = Recorder({}, ())
+        after = Recorder({}, ())
+        walker = Walker({}, ())
+        cal = create_calendar("keep 1", "drop 2", "keep 3")
+        await run_processors(
+            [
+                before,
+                FilterOut({"summary": {"match": "drop.*"}}, ()),
+                ModUid({"suffix": "@test"}, ()),
+                after,
+                walker,
+            ],
+            cal,
+        )
+        self.assertEqual(before.seen, ["keep 1", "drop 2", "keep 3"])
+        # dropped events never reach later processors
+        self.assertEqual(after.seen, ["keep 1", "keep 3"])
+        self.assertEqual(walker.seen, ["keep 1@test", "keep 3@test"])
+
+    async def test_decoded_once(self) -> None:
+        decodes = []  # type: List[str]
+        decode = Event._decode
+
+        def counting_decode(self: Event, name: str, value: Any) -> Any:
+            decodes.append(name.upper())
+            return decode(self, name, value)
+
+        cal = create_calendar("keep 1", "drop 2")
+        with mock.patch.object(Event, "_decode", counting_decode):
+            await run_processors(
+                [
+                    FilterOut({"summary": {"match": "drop.*"}}, ()),
+                    StripEmoji({"properties": ["summary"]}, ()),
+                    ModUid({"suffix": "@test"}, ()),
+                    FilterOut({"summary": {"match": "drop.*"}}, ()),
+                    ModUid({"prefix": "test-"}, ()),
+                ],
+                cal,
+            )
+        # the UID was rewritten in between, so it is decoded once more
+        self.assertEqual(sorted(decodes), ["SUMMARY", "SUMMARY", "UID", "UID"])
+        self.assertEqual(
+            [as_str(ev.decoded("uid")) for ev in cal.walk("vevent")],
+            ["test-keep 1@test"],
+        )
+
+    async def test_not_implemented(self) -> None:
+        class Incomplete(CalendarProcessor):
+            def __init__(self, args: Any, path: ConfigPath):
+                pass
+
+        cal = create_calendar("keep 1")
+        with self.assertRaises(NotImplementedError):
+            await Incomplete({}, ()).run(cal)
+        with self.assertRaises(NotImplementedError):
+            await run_processors([Incomplete({}, ())], cal)
+
+
+class FilterOutTest(unittest.IsolatedAsyncioTestCase):
+    async def test_conditions(self) -> None:
+        cal = create_calendar("keep", "Barabend", "Termin X", "party", "old", "meta")
+        events = cal.walk("vevent")
+        events[3].add("categories", ["Music", "Private"])
+        events[4].add("dtstart", date(2020, 1, 1))
+        events[5].add("location", "Online")
+        for i, ev in enumerate(events):
+            if "dtstart" not in ev:
+                ev.add("dtstart", datetime(2026, 10, i + 1, tzinfo=timezone.utc))
+
+        proc = FilterOut(
+            {
+                "summary": {"match": ["Barabend.*", "Termin.*"]},
+                "categories": {"match": "private"},
+                "location": {"match": ["(?i)online", "Zoom"]},
+                "dtstart": {"before": date(2026, 1, 1)},
+            },
+            (),
+        )
+        await proc.run(cal)
+        self.assertEqual(
+            [as_str(ev.decoded("summary")) for ev in cal.walk("vevent")],
+            ["keep", "party"],
+        )
+        self.assertEqual(
+            proc.removed,
+            {"summary": 2, "categories": 0, "location": 1, "dtstart": 1},
+        )
+
+    async def test_categories(self) -> None:
+        cal = create_calendar("keep", "private", "work")
+        events = cal.walk("vevent")
+        events[0].add("categories", ["Music"])
+        events[1].add("categories", ["Music", "Private"])
+        events[2].add("categories", "Work")
+        events[2].add("categories", "Travel")
+
+        proc = FilterOut({"categories": {"match": ["Private", "Trav.*"]}}, ())
+        await proc.run(cal)
+        self.assertEqual(
+            [as_str(ev.decoded("summary")) for ev in cal.walk("vevent")],
+            ["keep"],
+        )
+        self.assertEqual(proc.removed, {"categories": 2})
+
+    async def test_alternation(self) -> None:
+        patterns = [
+            "Meeting.*",
+            "(?i)lunch",
+            r"(\w)\1+",
+            r"(?P<word>\w+) (?P=word)",
+            r"(\d)-\1",
+        ]
+        cases = {
+            "Meeting 1": False,
+            "meeting 1": True,
+            "LUNCH": False,
+            "Lunch break": True,
+            "aaa": False,
+            "ab": True,
+            "again again": False,
+            "again and again": True,
+            "7-7": False,
+            "7-8": True,
+        }
+        cal = create_calendar(*cases)
+        proc = FilterOut({"summary": {"match": patterns}}, ())
+        # the patterns without groups are combined, those with groups are
+        # kept apart so their backreferences keep their meaning
+        self.assertEqual(len(proc.conditions["summary"]["match"]), 4)
+        await proc.run(cal)
+        self.assertEqual(
+            [as_str(ev.decoded("summary")) for ev in cal.walk("vevent")],
+            [summary for summary, kept in cases.items() if kept],
+        )
+
+    def test_invalid(self) -> None:
+        invalid = [
+            {},
+            {"summary": {"match": "("}},
+            {"summary": {"match": []}},
+            {"summary": {"after": date(2026, 1, 1)}},
+            {"dtstart": {"before": "2026-01-01"}},
+            {"url": {"match": ".*"}},
+        ]  # type: List[Dict[str, Any]]
+        for args in invalid:
+            with self.subTest(args=args):
+                with self.assertRaises(ValueError):
+                    FilterOut(args, ("processors", 0, "args"))
+
+
+FLOATING = b"""\
+BEGIN:VCALENDAR\r
+BEGIN:VEVENT\r
+DTSTART;VALUE=TIME:120000\r
+DTEND:20260101T130000\r
+DTSTAMP:20260101T120000Z\r
+DESCRIPTION:20260101T130000\r
+EXDATE:20260108T120000,20260115T120000\r
+EXDATE;TZID=America/New_York:20260122T120000\r
+BEGIN:VALARM\r
+TRIGGER;VALUE=DATE-TIME:20260101T090000\r
+END:VALARM\r
+BEGIN:VALARM\r
+TRIGGER:-PT5M\r
+END:VALARM\r
+END:VEVENT\r
+END:VCALENDAR\r
+"""
+
+BERLIN = b"""\
+BEGIN:VTIMEZONE\r
+TZID:Europe/Berlin\r
+END:VTIMEZONE\r
+"""
+
+
+def decode_all(event: Component) -> None:
+    # what add_default_timezone did before it knew which properties can hold
+    # DATE-TIMEs
+    for comp, name, value in iter_property_items(event):
+        comp._decode(name, value)
+
+
+class AddDefaultTimezoneTest(unittest.IsolatedAsyncioTestCase):
+    async def test_utc(self) -> None:
+        cal = Calendar.from_ical(FLOATING)
+        await AddDefaultTimezone({"utc": True}, ()).run(cal)
+        ical = cal.to_ical()
+        for line in [
+            b"DTSTART;VALUE=TIME:120000Z",
+            b"DTEND:20260101T130000Z",
+            b"DTSTAMP:20260101T120000Z",
+            b"DESCRIPTION:20260101T130000",
+            b"EXDATE:20260108T120000Z,20260115T120000Z",
+            b"EXDATE;TZID=America/New_York:20260122T120000",
+            b"TRIGGER;VALUE=DATE-TIME:20260101T090000Z",
+            b"TRIGGER:-PT5M",
+        ]:
+            self.assertIn(line + b"\r\n", ical)
+        self.assertNotIn(b"VTIMEZONE", ical)
+
+    async def test_vtimezone(self) -> None:
+        cal = Calendar.from_ical(FLOATING)
+        await AddDefaultTimezone({"vtimezone": as_str(BERLIN)}, ()).run(cal)
+        ical = cal.to_ical()
+        for line in [
+            b"DTSTART;TZID=Europe/Berlin;VALUE=TIME:120000",
+            b"DTEND;TZID=Europe/Berlin:20260101T130000",
+            b"DTSTAMP:20260101T120000Z",
+            b"EXDATE;TZID=Europe/Berlin:20260108T120000,20260115T120000",
+            b"EXDATE;TZID=America/New_York:20260122T120000",
+            b"TRIGGER;TZID=Europe/Berlin;VALUE=DATE-TIME:20260101T090000",
+        ]:
+            self.assertIn(line + b"\r\n", ical)
+        self.assertTrue(ical.endswith(BERLIN + b"END:VCALENDAR\r\n"))
+
+    @unittest.skipUnless(BENCHMARK, "set ICSMERGE_BENCHMARK=1 to run benchmarks")
+    async def test_benchmark(self) -> None:
+        lines = [b"BEGIN:VCALENDAR"]
+        for i in range(500):
+            lines.append(b"BEGIN:VEVENT")
+            lines.append(b"UID:%d@test" % i)
+            lines.append(b"DTSTART:20260101T%02d0000" % (i % 24))
+            lines.append(b"DESCRIPTION:" + b"lorem ipsum " * 1000)
+            for j in range(10):
+                lines.append(b"BEGIN:VALARM")
+                lines.append(b"ACTION:DISPLAY")
+                lines.append(b"DESCRIPTION:reminder")
+                lines.append(b"TRIGGER:-PT%dM" % (5 * j))
+                lines.append(b"END:VALARM")
+            lines.append(b"END:VEVENT")
+        lines.append(b"END:VCALENDAR")
+        ical = b"\r\n".join(lines)
+        expected = Calendar.from_ical(ical)
+        actual = Calendar.from_ical(ical)
+
+        t0 = time.perf_counter()
+        for event in expected.walk("vevent"):
+            decode_all(event)
+        t1 = time.perf_counter()
+        await AddDefaultTimezone({"utc": True}, ()).run(actual)
+        t2 = time.perf_counter()
+
+        self.assertEqual(
+            actual.walk("vevent")[0].decoded("dtstart"),
+            datetime(2026, 1, 1, tzinfo=timezone.utc),
+        )
+        print(
+            "\nadd_default_timezone on %d events: decoding all %.3fs, DATE-TIMEs %.3fs"
+            % (len(actual.walk("vevent")), t1 - t0, t2 - t1)
+        )
+        self.assertLess(t2 - t1, t1 - t0)
+
+
+PLUGIN = """
+from icsmerge.processors import CalendarProcessor
+
+
+class Processor(CalendarProcessor):
+    def __init__(self, args, path):
+        pass
+
+    def process_event(self, event):
+        return "summary" in event
+"""
+
+
+class PluginTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tmpdir.name, "icsmerge_test_plugin.py"), "w") as fp:
+            fp.write(PLUGIN)
+        distinfo = os.path.join(self.tmpdir.name, "icsmerge_test_plugin-1.0.dist-info")
+        os.mkdir(distinfo)
+        with open(os.path.join(distinfo, "METADATA"), "w") as fp:
+            fp.write(
+                "Metadata-Version: 2.1\nName: icsmerge-test-plugin\nVersion: 1.0\n"
+            )
+        with open(os.path.join(distinfo, "entry_points.txt"), "w") as fp:
+            fp.write(
+                "[icsmerge.processors]\n"
+                "drop_without_summary = icsmerge_test_plugin:Processor\n"
+                "broken = icsmerge_test_plugin:Processor.process_event\n"
+            )
+        sys.path.insert(0, self.tmpdir.name)
+
+    def tearDown(self) -> None:
+        sys.path.remove(self.tmpdir.name)
+        sys.modules.pop("icsmerge_test_plugin", None)
+        self.tmpdir.cleanup()
+
+    def test_entry_point(self) -> None:
+        self.assertIn("drop_without_summary", all_processors)
+        self.assertIn("drop_without_summary", list(all_processors))
+        self.assertNotIn("icsmerge_test_plugin", sys.modules)
+        proc = all_processors["drop_without_summary"]
+        self.assertEqual(proc.__module__, "icsmerge_test_plugin")
+        self.assertIsNone(all_processors.get("unknown"))
+        with self.assertRaises(TypeError):
+            all_processors["broken"]
@@ -0,0 +1,103 @@
+"""
+icsmerge
+Copyright (C) 2026  schnusch
+
+This program is free software; you can redistribute it and/or
+modify it under the terms of the GNU General Public License
+as published by the Free Software Foundation; either version 2
+of the License, or (at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from typing import Dict, List, Tuple
+
+BENCHMARK = bool(os.environ.get("ICSMERGE_BENCHMARK"))
+
+CONFIG = """
+destdir = '/tmp/icsmerge/dest'
+workdir = '/tmp/icsmerge/work'
+
+[calendars.a]
+url = 'https://example.com/a.ics'
+processors = [ {processor} ]
+"""
+
+SCRIPT = """
+import json
+import sys
+from icsmerge.config import load_config
+load_config(sys.argv[1])
+json.dump(list(sys.modules), sys.stdout)
+"""
+
+
+def load_config_in_subprocess(
+    processor: str,
+) -> Tuple[List[str], Dict[str, Tuple[int, int]]]:
+    # -X importtime does not log importlib.import_module(), so the loaded
+    # modules are taken from sys.modules
+    with tempfile.NamedTemporaryFile("w", suffix=".toml") as config:
+        config.write(CONFIG.format(processor=processor))
+        config.flush()
+        p = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", SCRIPT, config.name],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            check=True,
+            encoding="utf-8",
+        )
+    # module -> (self, cumulative) import time in microseconds
+    times = {}  # type: Dict[str, Tuple[int, int]]
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_us, cumulative_us, module = line[12:].split("|")
+            times[module.strip()] = (int(self_us), int(cumulative_us))
+        except ValueError:
+            continue
+    return (json.loads(p.stdout), times)
+
+
+class StartupTest(unittest.TestCase):
+    def test_lazy_imports(self) -> None:
+        modules, _ = load_config_in_subprocess(
+            "{ name = 'mod_uid', args.suffix = '@a' }"
+        )
+        self.assertIn("icsmerge.processors.mod_uid", modules)
+        for module in [
+            "aiohttp",
+            "emoji",
+            "concurrent.futures.process",
+            # plugins are only looked up for names that are not built in
+            "importlib.metadata",
+            "icsmerge.processors.strip_emoji",
+        ]:
+            self.assertNotIn(module, modules)
+
+        modules, _ = load_config_in_subprocess(
+            "{ name = 'strip_emoji', args.properties = [ 'summary' ] }"
+        )
+        self.assertIn("emoji", modules)
+
+    @unittest.skipUnless(BENCHMARK, "set ICSMERGE_BENCHMARK=1 to run benchmarks")
+    def test_benchmark(self) -> None:
+        _, times = load_config_in_subprocess("{ name = 'mod_uid', args.suffix = '@a' }")
+        print(
+            "\nstartup: import icsmerge %.1fms, icalendar %.1fms"
+            % (times["icsmerge"][1] / 1000, times["icalendar"][1] / 1000)
+        )